@@ -1,87 +1,144 @@
 from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from jose import JWTError, jwt
-from datetime import datetime, timedelta
-from backend.database.db import get_db, DatabaseOperations
+from starlette.concurrency import run_in_threadpool
+from datetime import timedelta
+from backend.database.db import get_db, DatabaseOperations, invalidate_user_sessions
 from backend.database.models import User
+from cachetools import TTLCache
+import base64
+import bcrypt
+import jwt
+import os
 import secrets
+import threading
+import time
 
 # Security Configuration
-SECRET_KEY = "your-secret-key-change-in-production"
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+SESSION_TOKEN_BYTES = 24  # Encodes to exactly 32 URL-safe characters, no padding
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Route hashing through passlib while migrating; raw bcrypt hashes stay $2b$ compatible
+USE_PASSLIB = os.getenv("USE_PASSLIB", "false").lower() == "true"
+
+# Precomputed JWT state reused across requests
+_SECRET_BYTES = SECRET_KEY.encode()
+_DEFAULT_TOKEN_TTL_SECONDS = 15 * 60
+_ACCESS_TOKEN_EXPIRES = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+_JWT_ALGORITHMS = [ALGORITHM]
+_JWT_DECODE_OPTIONS = {"require": ["exp", "sub"]}
+_jwt_decode = jwt.PyJWT().decode
+
+# User lookup cache
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL_SECONDS = 30
 
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+if USE_PASSLIB:
+    from passlib.context import CryptContext
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
 security = HTTPBearer()
 
+_user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL_SECONDS)
+_user_cache_lock = threading.Lock()
+
+def _cached_get_user(db: Session, username: str):
+    """Get user by username, serving recently seen rows from the TTL cache"""
+    with _user_cache_lock:
+        cached_user = _user_cache.get(username)
+    
+    if cached_user is None:
+        user = DatabaseOperations.get_user_by_username(db, username)
+        if user is None:
+            return None
+        # Keep a detached copy so the cached row outlives this session
+        db.expunge(user)
+        with _user_cache_lock:
+            _user_cache[username] = user
+        cached_user = user
+    
+    # Attach a copy to the caller's session without hitting the database
+    return db.merge(cached_user, load=False)
+
+def invalidate_user_cache(username: str):
+    """Drop a cached user row, e.g. after registration or a password change"""
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+
 class AuthService:
     
     @staticmethod
     def verify_password(plain_password: str, hashed_password: str) -> bool:
         """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+        if USE_PASSLIB:
+            return pwd_context.verify(plain_password, hashed_password)
+        return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
     
     @staticmethod
     def get_password_hash(password: str) -> str:
         """Hash a password"""
-        return pwd_context.hash(password)
+        if USE_PASSLIB:
+            return pwd_context.hash(password)
+        return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
     
     @staticmethod
     def create_access_token(data: dict, expires_delta: timedelta = None):
         """Create JWT access token"""
-        to_encode = data.copy()
-        if expires_delta:
-            expire = datetime.utcnow() + expires_delta
-        else:
-            expire = datetime.utcnow() + timedelta(minutes=15)
-        to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+        ttl_seconds = expires_delta.total_seconds() if expires_delta else _DEFAULT_TOKEN_TTL_SECONDS
+        # Integer epoch exp (allowed by the JWT spec) avoids datetime conversion
+        to_encode = {**data, "exp": int(time.time() + ttl_seconds)}
+        encoded_jwt = jwt.encode(to_encode, _SECRET_BYTES, algorithm=ALGORITHM)
         return encoded_jwt
     
     @staticmethod
-    def authenticate_user(db: Session, username: str, password: str):
+    async def authenticate_user(db: Session, username: str, password: str):
         """Authenticate user with username and password"""
-        user = DatabaseOperations.get_user_by_username(db, username)
+        user = _cached_get_user(db, username)
         if not user:
+            # Burn an equivalent bcrypt check so unknown usernames aren't revealed by timing
+            await run_in_threadpool(AuthService.verify_password, password, _DUMMY_HASH)
             return False
-        if not AuthService.verify_password(password, user.hashed_password):
+        # bcrypt is CPU-bound; keep it off the event loop
+        if not await run_in_threadpool(AuthService.verify_password, password, user.hashed_password):
             return False
         return user
     
     @staticmethod
-    def register_user(db: Session, username: str, email: str, password: str):
+    async def register_user(db: Session, username: str, email: str, password: str):
         """Register a new user"""
         # Check if user already exists
-        if DatabaseOperations.get_user_by_username(db, username):
+        username_taken, email_taken = DatabaseOperations.check_user_exists(db, username, email)
+        if username_taken:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already registered"
             )
         
-        if DatabaseOperations.get_user_by_email(db, email):
+        if email_taken:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
             )
         
         # Create new user
-        hashed_password = AuthService.get_password_hash(password)
+        hashed_password = await run_in_threadpool(AuthService.get_password_hash, password)
         user = DatabaseOperations.create_user(
             db=db,
             username=username,
             email=email,
             hashed_password=hashed_password
         )
+        invalidate_user_cache(username)
         return user
     
     @staticmethod
-    def login_user(db: Session, username: str, password: str, ip_address: str = None, user_agent: str = None):
+    async def login_user(db: Session, username: str, password: str, ip_address: str = None, user_agent: str = None):
         """Login user and create session"""
         # Authenticate user
-        user = AuthService.authenticate_user(db, username, password)
+        user = await AuthService.authenticate_user(db, username, password)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -90,13 +147,12 @@ class AuthService:
             )
         
         # Create access token
-        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = AuthService.create_access_token(
-            data={"sub": user.username}, expires_delta=access_token_expires
+            data={"sub": user.username}, expires_delta=_ACCESS_TOKEN_EXPIRES
         )
         
         # Create session
-        session_token = secrets.token_urlsafe(32)
+        session_token = base64.urlsafe_b64encode(secrets.token_bytes(SESSION_TOKEN_BYTES)).decode("ascii")
         session = DatabaseOperations.create_session(
             db=db,
             user_id=user.id,
@@ -113,6 +169,9 @@ class AuthService:
             "username": user.username
         }
 
+# Fixed hash at the configured cost, verified against when a username doesn't exist
+_DUMMY_HASH = AuthService.get_password_hash(secrets.token_urlsafe(16))
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
     """Get current authenticated user"""
     credentials_exception = HTTPException(
@@ -122,14 +181,17 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
     )
     
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = _jwt_decode(
+            credentials.credentials, _SECRET_BYTES,
+            algorithms=_JWT_ALGORITHMS, options=_JWT_DECODE_OPTIONS
+        )
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.PyJWTError:
         raise credentials_exception
     
-    user = DatabaseOperations.get_user_by_username(db, username=username)
+    user = _cached_get_user(db, username)
     if user is None:
         raise credentials_exception
     return user
@@ -137,9 +199,10 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 # Add FastAPI router and endpoints
 from fastapi import APIRouter
 from pydantic import BaseModel
+from backend.utils.routing import ORJSONRoute
 
 # Create router
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
 
 # Pydantic models
 class UserLogin(BaseModel):
@@ -156,7 +219,7 @@ class UserRegister(BaseModel):
 async def login(user_data: UserLogin, db: Session = Depends(get_db)):
     """User login endpoint"""
     try:
-        result = AuthService.login_user(
+        result = await AuthService.login_user(
             db=db,
             username=user_data.username,
             password=user_data.password
@@ -171,7 +234,7 @@ async def login(user_data: UserLogin, db: Session = Depends(get_db)):
 async def register(user_data: UserRegister, db: Session = Depends(get_db)):
     """User registration endpoint"""
     try:
-        user = AuthService.register_user(
+        user = await AuthService.register_user(
             db=db,
             username=user_data.username,
             email=user_data.email,
@@ -202,4 +265,5 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 async def logout(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """User logout endpoint"""
     # In a real implementation, you would invalidate the session token
+    invalidate_user_sessions(current_user.id)
     return {"message": "Logged out successfully"}
\ No newline at end of file
@@ -1,14 +1,79 @@
 from fastapi import HTTPException, Depends, status
+from sqlalchemy import DateTime, bindparam, func, update
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
-from backend.database.db import get_db, DatabaseOperations
+from typing import Dict
+from backend.database.db import get_db, DatabaseOperations, SessionLocal, invalidate_active_session
 from backend.database.models import User, UserSession
 from backend.ml.predict import predictor
 from backend.trust.trust_engine import trust_engine
+import asyncio
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Session activity write buffer (session_id -> latest activity time)
+ACTIVITY_FLUSH_INTERVAL_SECONDS = 2
+
+_activity_buffer: Dict[int, datetime] = {}
+_activity_buffer_lock = threading.Lock()
+
+# last_activity only moves forward: a buffered time older than one written directly meanwhile
+# (e.g. by a trust update) must not roll it back
+_sessions_table = UserSession.__table__
+_flush_activity_stmt = update(_sessions_table).where(
+    _sessions_table.c.id == bindparam("session_id")
+).values(
+    last_activity=func.max(
+        func.coalesce(_sessions_table.c.last_activity, bindparam("activity_time", type_=DateTime)),
+        bindparam("activity_time", type_=DateTime)
+    )
+)
+
+def record_session_activity(session_id: int) -> datetime:
+    """Buffer a last_activity update instead of committing it immediately"""
+    now = datetime.utcnow()
+    with _activity_buffer_lock:
+        _activity_buffer[session_id] = now
+    return now
+
+def flush_activity_buffer() -> int:
+    """Write all buffered last_activity updates in a single executemany UPDATE, never moving one back"""
+    global _activity_buffer
+    with _activity_buffer_lock:
+        pending, _activity_buffer = _activity_buffer, {}
+    
+    if not pending:
+        return 0
+    
+    db = SessionLocal()
+    try:
+        db.execute(_flush_activity_stmt, [
+            {"session_id": session_id, "activity_time": last_activity}
+            for session_id, last_activity in pending.items()
+        ])
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to flush session activity: {str(e)}")
+        # Requeue without clobbering newer updates recorded meanwhile
+        with _activity_buffer_lock:
+            for session_id, last_activity in pending.items():
+                _activity_buffer.setdefault(session_id, last_activity)
+        return 0
+    finally:
+        db.close()
+    
+    return len(pending)
+
+async def activity_flush_loop(interval: float = ACTIVITY_FLUSH_INTERVAL_SECONDS):
+    """Background task that periodically flushes buffered session activity"""
+    while True:
+        await asyncio.sleep(interval)
+        await run_in_threadpool(flush_activity_buffer)
+
 class SessionVerifier:
     """
     Session verification and continuous authentication
@@ -37,6 +102,7 @@ class SessionVerifier:
         if session_age > timedelta(hours=24):
             session.is_active = False
             db.commit()
+            invalidate_active_session(session_token)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Session expired"
@@ -89,16 +155,15 @@ class SessionVerifier:
         # Verify trust level
         trust_verification = SessionVerifier.verify_trust_level(session, db)
         
-        # Update session activity
-        session.last_activity = datetime.utcnow()
-        db.commit()
+        # Update session activity (flushed in bulk by activity_flush_loop)
+        last_activity = record_session_activity(session.id)
         
         return {
             "session_id": session.id,
             "user_id": session.user_id,
             "session_verified": True,
             "trust_verification": trust_verification,
-            "last_activity": session.last_activity
+            "last_activity": last_activity
         }
     
     @staticmethod
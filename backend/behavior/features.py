@@ -1,12 +1,88 @@
 import numpy as np
 import pandas as pd
-from typing import Dict, List, Tuple, Any
+from typing import Dict, Iterable, List, Sequence, Tuple, Any
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from sklearn.decomposition import PCA
-import json
-from datetime import datetime, timedelta
+import orjson
+from collections import defaultdict
+from itertools import groupby
+from cachetools import TTLCache
+from sqlalchemy import func
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Session
 from ..database.models import BehavioralEvent, UserSession
+from ..utils.jit import njit, NUMBA_AVAILABLE
+import threading
+
+# Expected feature order (this should be consistent across all users)
+# This should include all possible features that can be extracted
+# In a real implementation, this would be learned from training data
+_EXPECTED_FEATURES = (
+    # Keystroke features
+    "ks_avg_dwell_time_mean", "ks_avg_dwell_time_std", "ks_avg_flight_time_mean",
+    "ks_typing_rhythm_variance_mean", "ks_pressure_consistency_mean",
+    "ks_dwell_consistency", "ks_flight_consistency", "ks_rhythm_stability",
+    
+    # Mouse features  
+    "ms_velocity_mean_mean", "ms_velocity_mean_std", "ms_path_efficiency_mean",
+    "ms_movement_smoothness_mean", "ms_click_precision_mean",
+    "ms_velocity_consistency", "ms_smoothness_consistency",
+    
+    # Temporal features
+    "temporal_avg_interval", "temporal_std_interval", "temporal_event_rate",
+    "activity_uniformity", "activity_peak_ratio",
+    
+    # Cross-modal features
+    "cross_ks_ms_ratio", "cross_temporal_correlation", "multitask_switch_rate"
+)
+
+# Requested PCA sizes; fit_scalers clamps them to what the training slice supports
+PCA_KEYSTROKE_COMPONENTS = 10
+PCA_MOUSE_COMPONENTS = 15
+
+# Session feature cache keyed by (session_id, last_event_id, event_count);
+# new events change the key, so stale entries simply age out
+FEATURE_CACHE_SIZE = 10_000
+FEATURE_CACHE_TTL_SECONDS = 60
+
+_feature_cache = TTLCache(maxsize=FEATURE_CACHE_SIZE, ttl=FEATURE_CACHE_TTL_SECONDS)
+_feature_cache_lock = threading.Lock()
+
+# Hot scan kernels: compiled with Numba when available, NumPy otherwise
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _bin_counts(relative_times, bin_size, num_bins):
+        """Count events per time bin, folding overflow into the last bin"""
+        counts = np.zeros(num_bins, dtype=np.int64)
+        for t in relative_times:
+            idx = min(int(t / bin_size), num_bins - 1)
+            counts[idx] += 1
+        return counts
+    
+    @njit(cache=True)
+    def _scan_switches(sorted_times, sorted_kinds):
+        """Count mode switches and the duration (seconds) spent in each mode before switching"""
+        durations = np.empty(len(sorted_kinds), dtype=np.float64)
+        switches = 0
+        current_start = sorted_times[0]
+        for i in range(1, len(sorted_kinds)):
+            if sorted_kinds[i] != sorted_kinds[i - 1]:
+                durations[switches] = (sorted_times[i] - current_start) / 1e6
+                current_start = sorted_times[i]
+                switches += 1
+        return switches, durations[:switches]
+else:
+    def _bin_counts(relative_times, bin_size, num_bins):
+        """Count events per time bin, folding overflow into the last bin"""
+        bin_idx = np.minimum((relative_times / bin_size).astype(np.int64), num_bins - 1)
+        return np.bincount(bin_idx, minlength=num_bins)
+    
+    def _scan_switches(sorted_times, sorted_kinds):
+        """Count mode switches and the duration (seconds) spent in each mode before switching"""
+        switches = np.diff(sorted_kinds) != 0
+        switch_times = sorted_times[np.flatnonzero(switches) + 1]
+        durations = np.diff(switch_times, prepend=sorted_times[0]) / 1e6
+        return int(switches.sum()), durations
 
 class FeatureEngineer:
     """
@@ -17,24 +93,113 @@ class FeatureEngineer:
     def __init__(self):
         self.keystroke_scaler = StandardScaler()
         self.mouse_scaler = StandardScaler()
-        self.pca_keystroke = PCA(n_components=10)
-        self.pca_mouse = PCA(n_components=15)
+        self.pca_keystroke = PCA(n_components=PCA_KEYSTROKE_COMPONENTS)
+        self.pca_mouse = PCA(n_components=PCA_MOUSE_COMPONENTS)
         self.is_fitted = False
     
     def extract_session_features(self, db: Session, session_id: int) -> Dict[str, float]:
         """Extract comprehensive features for a user session"""
         
-        # Get all behavioral events for this session
-        events = db.query(BehavioralEvent).filter(
+        # Cheap fingerprint of the session's events to detect new data
+        last_event_id, event_count = db.query(
+            func.max(BehavioralEvent.id), func.count(BehavioralEvent.id)
+        ).filter(BehavioralEvent.session_id == session_id).one()
+        
+        if not event_count:
+            return {}
+        
+        cache_key = (session_id, last_event_id, event_count)
+        with _feature_cache_lock:
+            cached = _feature_cache.get(cache_key)
+        if cached is not None:
+            return dict(cached)
+        
+        features = self._extract_session_features_uncached(db, session_id)
+        
+        with _feature_cache_lock:
+            _feature_cache[cache_key] = features
+        return dict(features)
+    
+    def extract_session_features_batch(self, db: Session,
+                                       session_ids: Sequence[int]) -> Dict[int, Dict[str, float]]:
+        """Extract features for several sessions with one fingerprint and one event query"""
+        
+        session_ids = list(dict.fromkeys(session_ids))
+        if not session_ids:
+            return {}
+        
+        fingerprints = {
+            row.session_id: (row.session_id, row.last_event_id, row.event_count)
+            for row in db.query(
+                BehavioralEvent.session_id,
+                func.max(BehavioralEvent.id).label("last_event_id"),
+                func.count(BehavioralEvent.id).label("event_count")
+            ).filter(
+                BehavioralEvent.session_id.in_(session_ids)
+            ).group_by(BehavioralEvent.session_id)
+        }
+        
+        results = {session_id: {} for session_id in session_ids}
+        missing = []
+        with _feature_cache_lock:
+            for session_id, cache_key in fingerprints.items():
+                cached = _feature_cache.get(cache_key)
+                if cached is not None:
+                    results[session_id] = dict(cached)
+                else:
+                    missing.append(session_id)
+        
+        if missing:
+            rows = db.query(
+                BehavioralEvent.session_id,
+                BehavioralEvent.event_type,
+                BehavioralEvent.timestamp,
+                BehavioralEvent.processed_features
+            ).filter(
+                BehavioralEvent.session_id.in_(missing)
+            ).order_by(BehavioralEvent.session_id, BehavioralEvent.timestamp).yield_per(1000)
+            
+            computed = {
+                session_id: self.extract_session_features_from_events(session_rows)
+                for session_id, session_rows in groupby(rows, key=lambda row: row.session_id)
+            }
+            with _feature_cache_lock:
+                for session_id, features in computed.items():
+                    _feature_cache[fingerprints[session_id]] = features
+            for session_id, features in computed.items():
+                results[session_id] = dict(features)
+        
+        return results
+    
+    def _extract_session_features_uncached(self, db: Session, session_id: int) -> Dict[str, float]:
+        """Extract session features straight from the database"""
+        
+        # Stream only the columns feature extraction needs (skips raw event_data)
+        rows = db.query(
+            BehavioralEvent.event_type,
+            BehavioralEvent.timestamp,
+            BehavioralEvent.processed_features
+        ).filter(
             BehavioralEvent.session_id == session_id
-        ).order_by(BehavioralEvent.timestamp).all()
+        ).order_by(BehavioralEvent.timestamp).yield_per(1000)
+        
+        return self.extract_session_features_from_events(rows)
+    
+    def extract_session_features_from_events(self, rows: Iterable[Row]) -> Dict[str, float]:
+        """Compute session features from already-fetched (event_type, timestamp, processed_features) rows"""
+        
+        # Separate keystroke and mouse events in a single pass
+        events = []
+        buckets = defaultdict(list)
+        for row in rows:
+            events.append(row)
+            buckets[row.event_type].append(row)
         
         if not events:
             return {}
         
-        # Separate keystroke and mouse events
-        keystroke_events = [e for e in events if e.event_type == "keystroke"]
-        mouse_events = [e for e in events if e.event_type == "mouse"]
+        keystroke_events = buckets.get("keystroke", [])
+        mouse_events = buckets.get("mouse", [])
         
         features = {}
         
@@ -49,7 +214,8 @@ class FeatureEngineer:
             features.update(mouse_features)
         
         # Extract temporal features
-        temporal_features = self.extract_temporal_features(events)
+        timestamps_us = self._timestamps_us(events)
+        temporal_features = self.extract_temporal_features(events, timestamps_us)
         features.update(temporal_features)
         
         # Extract cross-modal features
@@ -59,111 +225,102 @@ class FeatureEngineer:
         
         return features
     
-    def extract_keystroke_features(self, events: List[BehavioralEvent]) -> Dict[str, float]:
+    def extract_keystroke_features(self, events: List[Row]) -> Dict[str, float]:
         """Extract advanced keystroke dynamics features"""
         features = {}
         
         # Aggregate all processed features
-        all_features = []
-        for event in events:
-            try:
-                event_features = json.loads(event.processed_features)
-                all_features.append(event_features)
-            except:
-                continue
+        all_features = self._load_processed_features(events)
         
         if not all_features:
             return {}
         
         # Statistical aggregation of features
-        feature_names = set()
-        for f in all_features:
-            feature_names.update(f.keys())
-        
-        for feature_name in feature_names:
-            values = [f.get(feature_name, 0) for f in all_features if feature_name in f]
-            if values:
-                features[f"ks_{feature_name}_mean"] = np.mean(values)
-                features[f"ks_{feature_name}_std"] = np.std(values)
-                features[f"ks_{feature_name}_median"] = np.median(values)
-                features[f"ks_{feature_name}_iqr"] = np.percentile(values, 75) - np.percentile(values, 25)
+        feature_names, matrix = self._build_feature_matrix(all_features)
+        means = np.nanmean(matrix, axis=0)
+        stds = np.nanstd(matrix, axis=0)
+        medians = np.nanmedian(matrix, axis=0)
+        q75, q25 = np.nanpercentile(matrix, [75, 25], axis=0)
+        iqrs = q75 - q25
+        
+        for i, feature_name in enumerate(feature_names):
+            features[f"ks_{feature_name}_mean"] = means[i]
+            features[f"ks_{feature_name}_std"] = stds[i]
+            features[f"ks_{feature_name}_median"] = medians[i]
+            features[f"ks_{feature_name}_iqr"] = iqrs[i]
         
         # Advanced keystroke patterns
         features.update(self._extract_keystroke_patterns(all_features))
         
         return features
     
-    def extract_mouse_features(self, events: List[BehavioralEvent]) -> Dict[str, float]:
+    def extract_mouse_features(self, events: List[Row]) -> Dict[str, float]:
         """Extract advanced mouse behavioral features"""
         features = {}
         
         # Aggregate all processed features
-        all_features = []
-        for event in events:
-            try:
-                event_features = json.loads(event.processed_features)
-                all_features.append(event_features)
-            except:
-                continue
+        all_features = self._load_processed_features(events)
         
         if not all_features:
             return {}
         
         # Statistical aggregation of features
-        feature_names = set()
-        for f in all_features:
-            feature_names.update(f.keys())
-        
-        for feature_name in feature_names:
-            values = [f.get(feature_name, 0) for f in all_features if feature_name in f]
-            if values:
-                features[f"ms_{feature_name}_mean"] = np.mean(values)
-                features[f"ms_{feature_name}_std"] = np.std(values)
-                features[f"ms_{feature_name}_median"] = np.median(values)
-                features[f"ms_{feature_name}_max"] = np.max(values)
-                features[f"ms_{feature_name}_min"] = np.min(values)
+        feature_names, matrix = self._build_feature_matrix(all_features)
+        means = np.nanmean(matrix, axis=0)
+        stds = np.nanstd(matrix, axis=0)
+        medians = np.nanmedian(matrix, axis=0)
+        maxs = np.nanmax(matrix, axis=0)
+        mins = np.nanmin(matrix, axis=0)
+        
+        for i, feature_name in enumerate(feature_names):
+            features[f"ms_{feature_name}_mean"] = means[i]
+            features[f"ms_{feature_name}_std"] = stds[i]
+            features[f"ms_{feature_name}_median"] = medians[i]
+            features[f"ms_{feature_name}_max"] = maxs[i]
+            features[f"ms_{feature_name}_min"] = mins[i]
         
         # Advanced mouse patterns
         features.update(self._extract_mouse_patterns(all_features))
         
         return features
     
-    def extract_temporal_features(self, events: List[BehavioralEvent]) -> Dict[str, float]:
+    def extract_temporal_features(self, events: List[Row],
+                                  timestamps_us: np.ndarray = None) -> Dict[str, float]:
         """Extract temporal behavioral patterns"""
         features = {}
         
         if len(events) < 2:
             return features
         
+        if timestamps_us is None:
+            timestamps_us = self._timestamps_us(events)
+        
         # Event timing patterns
-        timestamps = [event.timestamp for event in events]
-        time_diffs = [(timestamps[i] - timestamps[i-1]).total_seconds() 
-                     for i in range(1, len(timestamps))]
+        time_diffs = np.diff(timestamps_us) / 1e6
         
-        if time_diffs:
-            features["temporal_avg_interval"] = np.mean(time_diffs)
-            features["temporal_std_interval"] = np.std(time_diffs)
-            features["temporal_max_gap"] = np.max(time_diffs)
-            features["temporal_activity_bursts"] = sum(1 for diff in time_diffs if diff < 0.5)
+        features["temporal_avg_interval"] = time_diffs.mean()
+        features["temporal_std_interval"] = time_diffs.std()
+        features["temporal_max_gap"] = time_diffs.max()
+        features["temporal_activity_bursts"] = int((time_diffs < 0.5).sum())
         
         # Session activity patterns
-        session_duration = (timestamps[-1] - timestamps[0]).total_seconds()
+        session_duration = (timestamps_us[-1] - timestamps_us[0]) / 1e6
         features["temporal_session_duration"] = session_duration
         features["temporal_event_rate"] = len(events) / session_duration if session_duration > 0 else 0
         
         # Activity distribution over time
-        features.update(self._extract_activity_distribution(timestamps))
+        features.update(self._extract_activity_distribution(timestamps_us))
         
         return features
     
-    def extract_cross_modal_features(self, keystroke_events: List[BehavioralEvent], 
-                                   mouse_events: List[BehavioralEvent]) -> Dict[str, float]:
+    def extract_cross_modal_features(self, keystroke_events: List[Row], 
+                                   mouse_events: List[Row]) -> Dict[str, float]:
         """Extract features that combine keystroke and mouse behavior"""
         features = {}
         
         # Synchronization patterns
-        ks_times = [e.timestamp for e in keystroke_events]
-        ms_times = [e.timestamp for e in mouse_events]
+        ks_times = self._timestamps_us(keystroke_events)
+        ms_times = self._timestamps_us(mouse_events)
         
         # Calculate interaction patterns
         features["cross_ks_ms_ratio"] = len(keystroke_events) / len(mouse_events) if mouse_events else 0
@@ -173,10 +330,44 @@ class FeatureEngineer:
         features["cross_temporal_correlation"] = correlation
         
         # Multitasking patterns
-        features.update(self._extract_multitasking_patterns(keystroke_events, mouse_events))
+        features.update(self._extract_multitasking_patterns(ks_times, ms_times))
         
         return features
     
+    def _load_processed_features(self, events: List[Row]) -> List[Dict]:
+        """Decode the processed feature JSON of each event, skipping empty or malformed rows"""
+        try:
+            return [orjson.loads(e.processed_features) for e in events if e.processed_features]
+        except orjson.JSONDecodeError:
+            # Fall back to per-event decoding so one bad row doesn't drop the batch
+            all_features = []
+            for event in events:
+                if not event.processed_features:
+                    continue
+                try:
+                    all_features.append(orjson.loads(event.processed_features))
+                except orjson.JSONDecodeError:
+                    continue
+            return all_features
+    
+    def _timestamps_us(self, events: List[Row]) -> np.ndarray:
+        """Event timestamps as an int64 array of epoch microseconds"""
+        return np.array(
+            [e.timestamp for e in events], dtype="datetime64[us]"
+        ).astype(np.int64)
+    
+    def _build_feature_matrix(self, features_list: List[Dict]) -> Tuple[List[str], np.ndarray]:
+        """Stack per-event feature dicts into an (n_events, n_features) matrix, NaN where missing"""
+        feature_names = sorted({name for f in features_list for name in f})
+        col_idx = {name: i for i, name in enumerate(feature_names)}
+        
+        matrix = np.full((len(features_list), len(feature_names)), np.nan, dtype=np.float64)
+        for row, f in enumerate(features_list):
+            for name, value in f.items():
+                matrix[row, col_idx[name]] = value
+        
+        return feature_names, matrix
+    
     def _extract_keystroke_patterns(self, features_list: List[Dict]) -> Dict[str, float]:
         """Extract advanced keystroke behavioral patterns"""
         patterns = {}
@@ -221,16 +412,15 @@ class FeatureEngineer:
         
         return patterns
     
-    def _extract_activity_distribution(self, timestamps: List[datetime]) -> Dict[str, float]:
+    def _extract_activity_distribution(self, timestamps_us: np.ndarray) -> Dict[str, float]:
         """Extract activity distribution patterns over time"""
         features = {}
         
-        if len(timestamps) < 10:
+        if len(timestamps_us) < 10:
             return features
         
         # Convert to relative time (seconds from start)
-        start_time = timestamps[0]
-        relative_times = [(t - start_time).total_seconds() for t in timestamps]
+        relative_times = (timestamps_us - timestamps_us[0]) / 1e6
         
         # Divide session into time bins and analyze activity
         session_duration = relative_times[-1]
@@ -238,169 +428,141 @@ class FeatureEngineer:
             num_bins = min(10, int(session_duration / 30))  # 30-second bins, max 10 bins
             if num_bins > 1:
                 bin_size = session_duration / num_bins
-                bin_counts = [0] * num_bins
-                
-                for time in relative_times:
-                    bin_idx = min(int(time / bin_size), num_bins - 1)
-                    bin_counts[bin_idx] += 1
+                bin_counts = _bin_counts(relative_times, bin_size, num_bins)
                 
                 # Activity distribution metrics
-                features["activity_uniformity"] = 1.0 - (np.std(bin_counts) / np.mean(bin_counts)) if np.mean(bin_counts) > 0 else 0
-                features["activity_peak_ratio"] = np.max(bin_counts) / np.mean(bin_counts) if np.mean(bin_counts) > 0 else 0
+                mean_count = bin_counts.mean()
+                features["activity_uniformity"] = 1.0 - (bin_counts.std() / mean_count) if mean_count > 0 else 0
+                features["activity_peak_ratio"] = bin_counts.max() / mean_count if mean_count > 0 else 0
         
         return features
     
-    def _calculate_temporal_correlation(self, ks_times: List[datetime], 
-                                      ms_times: List[datetime]) -> float:
+    def _calculate_temporal_correlation(self, ks_times: np.ndarray, 
+                                      ms_times: np.ndarray) -> float:
         """Calculate temporal correlation between keystroke and mouse events"""
         if len(ks_times) < 5 or len(ms_times) < 5:
             return 0.0
         
         # Create time series with 1-second resolution
-        all_times = sorted(ks_times + ms_times)
-        start_time = all_times[0]
-        end_time = all_times[-1]
-        duration = (end_time - start_time).total_seconds()
+        start_time = min(ks_times.min(), ms_times.min())
+        end_time = max(ks_times.max(), ms_times.max())
+        duration = (end_time - start_time) / 1e6
         
         if duration < 10:  # Need at least 10 seconds
             return 0.0
         
-        # Create binary time series
+        # Create binary time series (events past the last whole second fold into the final bin)
         time_bins = int(duration)
-        ks_series = [0] * time_bins
-        ms_series = [0] * time_bins
-        
-        for t in ks_times:
-            bin_idx = min(int((t - start_time).total_seconds()), time_bins - 1)
-            ks_series[bin_idx] = 1
+        ks_rel = np.minimum((ks_times - start_time) / 1e6, time_bins - 1)
+        ms_rel = np.minimum((ms_times - start_time) / 1e6, time_bins - 1)
         
-        for t in ms_times:
-            bin_idx = min(int((t - start_time).total_seconds()), time_bins - 1)
-            ms_series[bin_idx] = 1
+        ks_series = (np.histogram(ks_rel, bins=time_bins, range=(0, time_bins))[0] > 0).astype(np.int8)
+        ms_series = (np.histogram(ms_rel, bins=time_bins, range=(0, time_bins))[0] > 0).astype(np.int8)
         
         # Calculate correlation
         correlation = np.corrcoef(ks_series, ms_series)[0, 1]
         return correlation if not np.isnan(correlation) else 0.0
     
-    def _extract_multitasking_patterns(self, ks_events: List[BehavioralEvent], 
-                                     ms_events: List[BehavioralEvent]) -> Dict[str, float]:
+    def _extract_multitasking_patterns(self, ks_times: np.ndarray, 
+                                     ms_times: np.ndarray) -> Dict[str, float]:
         """Extract multitasking behavioral patterns"""
         features = {}
         
-        # Combine and sort all events by timestamp
-        all_events = [(e.timestamp, 'ks') for e in ks_events] + [(e.timestamp, 'ms') for e in ms_events]
-        all_events.sort()
+        # Combine and sort all events by timestamp (stable, so keystrokes win ties)
+        all_times = np.concatenate([ks_times, ms_times])
+        kinds = np.concatenate([
+            np.zeros(len(ks_times), dtype=np.int8),
+            np.ones(len(ms_times), dtype=np.int8)
+        ])
         
-        if len(all_events) < 10:
+        if len(all_times) < 10:
             return features
         
-        # Analyze switching patterns
-        switches = 0
-        current_mode = all_events[0][1]
-        
-        for _, event_type in all_events[1:]:
-            if event_type != current_mode:
-                switches += 1
-                current_mode = event_type
-        
-        features["multitask_switch_rate"] = switches / len(all_events)
-        
-        # Analyze mode persistence (how long user stays in one mode)
-        mode_durations = []
-        current_start = all_events[0][0]
-        current_mode = all_events[0][1]
+        order = np.argsort(all_times, kind='mergesort')
+        sorted_times = all_times[order]
+        sorted_kinds = kinds[order]
         
-        for timestamp, event_type in all_events[1:]:
-            if event_type != current_mode:
-                duration = (timestamp - current_start).total_seconds()
-                mode_durations.append(duration)
-                current_start = timestamp
-                current_mode = event_type
+        # Analyze switching patterns and mode persistence (how long user stays in one mode)
+        switches, mode_durations = _scan_switches(sorted_times, sorted_kinds)
+        features["multitask_switch_rate"] = switches / len(all_times)
         
-        if mode_durations:
-            features["multitask_avg_persistence"] = np.mean(mode_durations)
-            features["multitask_persistence_variance"] = np.var(mode_durations)
+        if len(mode_durations):
+            features["multitask_avg_persistence"] = mode_durations.mean()
+            features["multitask_persistence_variance"] = mode_durations.var()
         
         return features
     
     def create_feature_vector(self, features_dict: Dict[str, float]) -> np.ndarray:
         """Convert feature dictionary to standardized vector"""
-        # Define expected feature order (this should be consistent across all users)
-        expected_features = self._get_expected_feature_names()
-        
-        # Create vector with default values
-        vector = []
-        for feature_name in expected_features:
-            value = features_dict.get(feature_name, 0.0)
-            # Handle NaN and infinite values
-            if np.isnan(value) or np.isinf(value):
-                value = 0.0
-            vector.append(value)
-        
-        return np.array(vector)
+        # Missing features default to 0.0 in the fixed expected order;
+        # float32 halves memory and bandwidth for the downstream transforms
+        vector = np.fromiter(
+            (features_dict.get(name, 0.0) for name in _EXPECTED_FEATURES),
+            dtype=np.float32, count=len(_EXPECTED_FEATURES)
+        )
+        
+        # Handle NaN and infinite values
+        return np.nan_to_num(vector, nan=0.0, posinf=0.0, neginf=0.0)
     
-    def _get_expected_feature_names(self) -> List[str]:
-        """Get list of expected feature names in consistent order"""
-        # This should include all possible features that can be extracted
-        # In a real implementation, this would be learned from training data
-        base_features = [
-            # Keystroke features
-            "ks_avg_dwell_time_mean", "ks_avg_dwell_time_std", "ks_avg_flight_time_mean",
-            "ks_typing_rhythm_variance_mean", "ks_pressure_consistency_mean",
-            "ks_dwell_consistency", "ks_flight_consistency", "ks_rhythm_stability",
-            
-            # Mouse features  
-            "ms_velocity_mean_mean", "ms_velocity_mean_std", "ms_path_efficiency_mean",
-            "ms_movement_smoothness_mean", "ms_click_precision_mean",
-            "ms_velocity_consistency", "ms_smoothness_consistency",
-            
-            # Temporal features
-            "temporal_avg_interval", "temporal_std_interval", "temporal_event_rate",
-            "activity_uniformity", "activity_peak_ratio",
-            
-            # Cross-modal features
-            "cross_ks_ms_ratio", "cross_temporal_correlation", "multitask_switch_rate"
-        ]
-        
-        return base_features
+    def _get_expected_feature_names(self) -> Tuple[str, ...]:
+        """Get expected feature names in consistent order"""
+        return _EXPECTED_FEATURES
     
     def fit_scalers(self, feature_vectors: List[np.ndarray]):
         """Fit scalers on training data"""
         if not feature_vectors:
             return
         
-        # Combine all feature vectors
-        X = np.vstack(feature_vectors)
+        # Combine all feature vectors (float32 end-to-end through scaler/PCA)
+        X = np.vstack(feature_vectors).astype(np.float32, copy=False)
         
         # Fit scalers
         self.keystroke_scaler.fit(X[:, :20])  # First 20 features are keystroke
         self.mouse_scaler.fit(X[:, 20:40])    # Next 20 are mouse
         
-        # Fit PCA for dimensionality reduction
+        # Fit PCA for dimensionality reduction (never more components than samples or columns)
+        self.pca_keystroke.set_params(n_components=min(PCA_KEYSTROKE_COMPONENTS, *X[:, :20].shape))
+        self.pca_mouse.set_params(n_components=min(PCA_MOUSE_COMPONENTS, *X[:, 20:40].shape))
         self.pca_keystroke.fit(X[:, :20])
         self.pca_mouse.fit(X[:, 20:40])
         
+        self._fuse_transforms()
         self.is_fitted = True
     
+    def _fuse_transforms(self):
+        """Collapse each scaler + PCA pair into one affine map: x -> W @ x + b"""
+        self._W_ks, self._b_ks = self._fused_affine(self.keystroke_scaler, self.pca_keystroke)
+        self._W_ms, self._b_ms = self._fused_affine(self.mouse_scaler, self.pca_mouse)
+    
+    @staticmethod
+    def _fused_affine(scaler: StandardScaler, pca: PCA) -> Tuple[np.ndarray, np.ndarray]:
+        """Precompute PCA(scale(x)) = components @ ((x - mean) / scale - pca_mean) as W, b"""
+        W = pca.components_ / scaler.scale_
+        b = -pca.components_ @ (scaler.mean_ / scaler.scale_ + pca.mean_)
+        return W.astype(np.float32), b.astype(np.float32)
+    
     def transform_features(self, feature_vector: np.ndarray) -> np.ndarray:
         """Transform features using fitted scalers"""
         if not self.is_fitted:
             return feature_vector
         
-        # Split features
-        ks_features = feature_vector[:20]
-        ms_features = feature_vector[20:40]
-        other_features = feature_vector[40:]
+        return self.transform_features_batch(feature_vector[None, :])[0]
+    
+    def transform_features_batch(self, X: np.ndarray) -> np.ndarray:
+        """Transform a (n_samples, n_features) matrix using fitted scalers"""
+        if not self.is_fitted:
+            return X
         
-        # Scale features
-        ks_scaled = self.keystroke_scaler.transform(ks_features.reshape(1, -1))[0]
-        ms_scaled = self.mouse_scaler.transform(ms_features.reshape(1, -1))[0]
+        # Split features
+        ks_features = X[:, :20]
+        ms_features = X[:, 20:40]
+        other_features = X[:, 40:]
         
-        # Apply PCA
-        ks_pca = self.pca_keystroke.transform(ks_scaled.reshape(1, -1))[0]
-        ms_pca = self.pca_mouse.transform(ms_scaled.reshape(1, -1))[0]
+        # Scale and apply PCA in a single fused matmul per modality
+        ks_pca = ks_features @ self._W_ks.T + self._b_ks
+        ms_pca = ms_features @ self._W_ms.T + self._b_ms
         
         # Combine transformed features
-        transformed = np.concatenate([ks_pca, ms_pca, other_features])
+        transformed = np.concatenate([ks_pca, ms_pca, other_features], axis=1)
         
         return transformed
\ No newline at end of file
@@ -1,14 +1,24 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from ..database.db import get_db, DatabaseOperations
-from ..database.models import BehavioralEvent
+from starlette.concurrency import run_in_threadpool
+from ..database.db import get_db, DatabaseOperations, enqueue_behavioral_event
+from ..database.models import KEYSTROKE_FEATURE_COLUMNS
+from ..utils.codec import encode_event_data
+from ..utils.jit import njit, NUMBA_AVAILABLE
+from ..utils.routing import ORJSONRoute
 from pydantic import BaseModel
-from typing import List, Dict, Any
-import json
+from typing import List, Dict, Any, Tuple
+import orjson
 import numpy as np
 from datetime import datetime
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
+
+# Features that make up the compact behavioral signature, in signature order
+SIGNATURE_FEATURES = (
+    'avg_dwell_time', 'avg_flight_time', 'typing_rhythm_variance',
+    'pressure_consistency', 'typing_cadence'
+)
 
 class KeystrokeData(BaseModel):
     eventType: str
@@ -17,99 +27,218 @@ class KeystrokeData(BaseModel):
     sessionToken: str
     timestamp: int
 
+# Keystroke summary kernel: one compiled scan with Numba when available, NumPy otherwise.
+# dwell/flight use NaN for missing timings; returns
+# (dwell_n, dwell_mean, dwell_std, dwell_min, dwell_max,
+#  flight_n, flight_mean, flight_std, flight_min, flight_max,
+#  rhythm_variance, pressure_consistency, special_key_ratio, error_correction_rate)
+if NUMBA_AVAILABLE:
+    @njit(cache=True, error_model='numpy')
+    def _keystroke_kernel(dwell, flight, is_special, is_backspace):
+        """Summarise dwell/flight timings and key ratios in a single compiled scan"""
+        n = len(dwell)
+        dwell_n = 0
+        dwell_sum = 0.0
+        dwell_min = np.inf
+        dwell_max = -np.inf
+        flight_n = 0
+        flight_sum = 0.0
+        flight_min = np.inf
+        flight_max = -np.inf
+        special = 0.0
+        backspace = 0.0
+        for i in range(n):
+            d = dwell[i]
+            if not np.isnan(d):
+                dwell_n += 1
+                dwell_sum += d
+                dwell_min = min(dwell_min, d)
+                dwell_max = max(dwell_max, d)
+            f = flight[i]
+            if not np.isnan(f):
+                flight_n += 1
+                flight_sum += f
+                flight_min = min(flight_min, f)
+                flight_max = max(flight_max, f)
+            special += is_special[i]
+            backspace += is_backspace[i]
+        
+        # Rhythm ignores the first key's flight time
+        first_flight = 0.0 if np.isnan(flight[0]) else flight[0]
+        rhythm_n = flight_n - (0 if np.isnan(flight[0]) else 1)
+        dwell_mean = dwell_sum / dwell_n if dwell_n else np.nan
+        flight_mean = flight_sum / flight_n if flight_n else np.nan
+        rhythm_mean = (flight_sum - first_flight) / rhythm_n if rhythm_n else 0.0
+        
+        # Second pass over the same arrays for centred sums of squares (two-pass, like NumPy)
+        dwell_ss = 0.0
+        flight_ss = 0.0
+        rhythm_ss = 0.0
+        for i in range(n):
+            d = dwell[i]
+            if not np.isnan(d):
+                dwell_ss += (d - dwell_mean) ** 2
+            f = flight[i]
+            if not np.isnan(f):
+                flight_ss += (f - flight_mean) ** 2
+                if i > 0:
+                    rhythm_ss += (f - rhythm_mean) ** 2
+        
+        dwell_std = np.sqrt(dwell_ss / dwell_n) if dwell_n else np.nan
+        flight_std = np.sqrt(flight_ss / flight_n) if flight_n else np.nan
+        rhythm_variance = rhythm_ss / rhythm_n if rhythm_n else 0.0
+        pressure_consistency = 1.0 / (1.0 + dwell_std / dwell_mean) if dwell_n >= 2 else 1.0
+        
+        return (dwell_n, dwell_mean, dwell_std, dwell_min, dwell_max,
+                flight_n, flight_mean, flight_std, flight_min, flight_max,
+                rhythm_variance, pressure_consistency, special / n, backspace / n)
+else:
+    def _keystroke_kernel(dwell, flight, is_special, is_backspace):
+        """Summarise dwell/flight timings and key ratios with NumPy reductions"""
+        dwell_times = dwell[~np.isnan(dwell)]
+        flight_times = flight[~np.isnan(flight)]
+        rhythm_intervals = flight[1:][~np.isnan(flight[1:])]
+        
+        dwell_stats = (dwell_times.mean(), dwell_times.std(), dwell_times.min(), dwell_times.max()) \
+            if dwell_times.size else (np.nan,) * 4
+        flight_stats = (flight_times.mean(), flight_times.std(), flight_times.min(), flight_times.max()) \
+            if flight_times.size else (np.nan,) * 4
+        
+        return (dwell_times.size, *dwell_stats,
+                flight_times.size, *flight_stats,
+                KeystrokeProcessor.calculate_rhythm_variance(rhythm_intervals),
+                KeystrokeProcessor.calculate_pressure_consistency(dwell_times),
+                is_special.mean(),
+                KeystrokeProcessor.calculate_error_rate(is_backspace))
+
 class KeystrokeProcessor:
     
     @staticmethod
     def extract_advanced_features(raw_keystrokes: List[Dict]) -> Dict[str, float]:
         """Extract advanced keystroke dynamics features"""
-        if len(raw_keystrokes) < 5:
+        n = len(raw_keystrokes)
+        if n < 5:
             return {}
         
-        dwell_times = [k['dwellTime'] for k in raw_keystrokes if 'dwellTime' in k]
-        flight_times = [k['flightTime'] for k in raw_keystrokes if k.get('flightTime')]
-        
-        if not dwell_times:
+        # Pre-sized parallel arrays (NaN marks a missing/empty timing)
+        dwell = np.fromiter(
+            (np.nan if k.get('dwellTime') is None else k['dwellTime'] for k in raw_keystrokes),
+            dtype=np.float64, count=n
+        )
+        flight = np.fromiter(
+            (k.get('flightTime') or np.nan for k in raw_keystrokes), dtype=np.float64, count=n
+        )
+        if np.isnan(dwell).all():
             return {}
         
+        is_special = np.fromiter(
+            (bool(k.get('isSpecialKey', False)) for k in raw_keystrokes), dtype=np.float64, count=n
+        )
+        is_backspace = np.fromiter(
+            (k.get('keyCode') == 'Backspace' for k in raw_keystrokes), dtype=np.float64, count=n
+        )
+        timestamps = np.fromiter(
+            (np.nan if k.get('timestamp') is None else k['timestamp'] for k in raw_keystrokes),
+            dtype=np.float64, count=n
+        )
+        
+        (dwell_n, dwell_mean, dwell_std, dwell_min, dwell_max,
+         flight_n, flight_mean, flight_std, flight_min, flight_max,
+         rhythm_variance, pressure_consistency, special_ratio, error_rate) = _keystroke_kernel(
+            dwell, flight, is_special, is_backspace
+        )
+        
         features = {}
         
         # Basic timing features
-        features['avg_dwell_time'] = np.mean(dwell_times)
-        features['std_dwell_time'] = np.std(dwell_times)
-        features['min_dwell_time'] = np.min(dwell_times)
-        features['max_dwell_time'] = np.max(dwell_times)
+        features['avg_dwell_time'] = dwell_mean
+        features['std_dwell_time'] = dwell_std
+        features['min_dwell_time'] = dwell_min
+        features['max_dwell_time'] = dwell_max
         
-        if flight_times:
-            features['avg_flight_time'] = np.mean(flight_times)
-            features['std_flight_time'] = np.std(flight_times)
-            features['min_flight_time'] = np.min(flight_times)
-            features['max_flight_time'] = np.max(flight_times)
+        if flight_n:
+            features['avg_flight_time'] = flight_mean
+            features['std_flight_time'] = flight_std
+            features['min_flight_time'] = flight_min
+            features['max_flight_time'] = flight_max
         
         # Rhythm and pattern features
-        features['typing_rhythm_variance'] = KeystrokeProcessor.calculate_rhythm_variance(raw_keystrokes)
-        features['pressure_consistency'] = KeystrokeProcessor.calculate_pressure_consistency(dwell_times)
-        features['typing_cadence'] = KeystrokeProcessor.calculate_typing_cadence(raw_keystrokes)
+        features['typing_rhythm_variance'] = rhythm_variance
+        features['pressure_consistency'] = pressure_consistency
+        features['typing_cadence'] = KeystrokeProcessor.calculate_typing_cadence(timestamps)
         
         # Behavioral patterns
-        features['special_key_ratio'] = sum(1 for k in raw_keystrokes if k.get('isSpecialKey', False)) / len(raw_keystrokes)
-        features['error_correction_rate'] = KeystrokeProcessor.calculate_error_rate(raw_keystrokes)
+        features['special_key_ratio'] = special_ratio
+        features['error_correction_rate'] = error_rate
         
         return features
     
     @staticmethod
-    def calculate_rhythm_variance(keystrokes: List[Dict]) -> float:
-        """Calculate variance in typing rhythm"""
-        if len(keystrokes) < 3:
-            return 0.0
-        
-        intervals = []
-        for i in range(1, len(keystrokes)):
-            if keystrokes[i].get('flightTime'):
-                intervals.append(keystrokes[i]['flightTime'])
-        
-        return np.var(intervals) if intervals else 0.0
+    def calculate_rhythm_variance(intervals: np.ndarray) -> float:
+        """Calculate variance in typing rhythm from inter-key flight times"""
+        return intervals.var() if intervals.size else 0.0
     
     @staticmethod
-    def calculate_pressure_consistency(dwell_times: List[float]) -> float:
+    def calculate_pressure_consistency(dwell_times: np.ndarray) -> float:
         """Calculate consistency in key press pressure (dwell time variance)"""
         if len(dwell_times) < 2:
             return 1.0
         
-        coefficient_of_variation = np.std(dwell_times) / np.mean(dwell_times)
+        coefficient_of_variation = dwell_times.std() / dwell_times.mean()
         return 1.0 / (1.0 + coefficient_of_variation)  # Higher = more consistent
     
     @staticmethod
-    def calculate_typing_cadence(keystrokes: List[Dict]) -> float:
+    def calculate_typing_cadence(timestamps: np.ndarray) -> float:
         """Calculate overall typing cadence (keys per second)"""
-        if len(keystrokes) < 2:
+        if len(timestamps) < 2:
             return 0.0
         
-        time_span = (keystrokes[-1]['timestamp'] - keystrokes[0]['timestamp']) / 1000.0  # Convert to seconds
-        return len(keystrokes) / time_span if time_span > 0 else 0.0
+        time_span = (timestamps[-1] - timestamps[0]) / 1000.0  # Convert to seconds
+        return len(timestamps) / time_span if time_span > 0 else 0.0
     
     @staticmethod
-    def calculate_error_rate(keystrokes: List[Dict]) -> float:
+    def calculate_error_rate(is_backspace: np.ndarray) -> float:
         """Estimate error correction rate based on backspace usage"""
-        backspace_count = sum(1 for k in keystrokes if k.get('keyCode') == 'Backspace')
-        return backspace_count / len(keystrokes) if keystrokes else 0.0
+        return is_backspace.mean() if is_backspace.size else 0.0
     
     @staticmethod
     def create_behavioral_signature(features: Dict[str, float]) -> str:
         """Create a compact behavioral signature for comparison"""
-        key_features = [
-            'avg_dwell_time', 'avg_flight_time', 'typing_rhythm_variance',
-            'pressure_consistency', 'typing_cadence'
-        ]
-        
-        signature_values = []
-        for feature in key_features:
-            if feature in features:
-                # Normalize and quantize features for signature
-                normalized = min(max(features[feature], 0), 1000)  # Clamp values
-                quantized = int(normalized / 10)  # Reduce precision
-                signature_values.append(str(quantized))
-        
-        return '_'.join(signature_values)
+        values = np.fromiter(
+            (features[feature] for feature in SIGNATURE_FEATURES if feature in features), dtype=np.float64
+        )
+        
+        # Normalize (clamp) and quantize features for signature (reduce precision)
+        quantized = (np.clip(values, 0, 1000) / 10).astype(np.int64)
+        return '_'.join(map(str, quantized.tolist()))
+
+def _process_keystroke_data_sync(data: KeystrokeData, db: Session) -> Tuple[Dict[str, Any], Dict[str, float], str]:
+    """Blocking part of process_keystroke_data: session lookup, feature extraction and row encoding"""
+    # Get session from token
+    session = DatabaseOperations.get_active_session(db, data.sessionToken)
+    if not session:
+        raise HTTPException(status_code=401, detail="Invalid session token")
+    
+    # Extract advanced features
+    advanced_features = KeystrokeProcessor.extract_advanced_features(data.rawData)
+    
+    # Combine with basic features
+    all_features = {**data.features, **advanced_features}
+    
+    # Create behavioral signature
+    signature = KeystrokeProcessor.create_behavioral_signature(all_features)
+    
+    # Encode the behavioral event row
+    behavioral_event = {
+        "session_id": session.id,
+        "event_type": "keystroke",
+        "event_data": encode_event_data(data.rawData),
+        "processed_features": orjson.dumps(all_features, option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+        "timestamp": datetime.fromtimestamp(data.timestamp / 1000),
+        **{name: all_features.get(name) for name in KEYSTROKE_FEATURE_COLUMNS}
+    }
+    
+    return behavioral_event, all_features, signature
 
 @router.post("/keystroke")
 async def process_keystroke_data(
@@ -118,38 +247,17 @@ async def process_keystroke_data(
 ):
     """Process incoming keystroke behavioral data"""
     try:
-        # Get session from token
-        session = DatabaseOperations.get_active_session(db, data.sessionToken)
-        if not session:
-            raise HTTPException(status_code=401, detail="Invalid session token")
-        
-        # Extract advanced features
-        advanced_features = KeystrokeProcessor.extract_advanced_features(data.rawData)
-        
-        # Combine with basic features
-        all_features = {**data.features, **advanced_features}
-        
-        # Create behavioral signature
-        signature = KeystrokeProcessor.create_behavioral_signature(all_features)
-        
-        # Store behavioral event
-        behavioral_event = BehavioralEvent(
-            session_id=session.id,
-            event_type="keystroke",
-            event_data=json.dumps(data.rawData),
-            processed_features=json.dumps(all_features),
-            timestamp=datetime.fromtimestamp(data.timestamp / 1000)
-        )
+        # Feature extraction is CPU-bound; keep it off the event loop
+        behavioral_event, all_features, signature = await run_in_threadpool(_process_keystroke_data_sync, data, db)
         
-        db.add(behavioral_event)
-        db.commit()
+        # Store behavioral event (written in batches by behavioral_event_flush_loop)
+        await enqueue_behavioral_event(behavioral_event)
         
         return {
             "status": "success",
             "message": f"Processed {len(data.rawData)} keystroke events",
             "features_extracted": len(all_features),
-            "behavioral_signature": signature,
-            "event_id": behavioral_event.id
+            "behavioral_signature": signature
         }
         
     except Exception as e:
@@ -162,59 +270,24 @@ async def get_keystroke_profile(
 ):
     """Get keystroke behavioral profile for a user"""
     try:
-        # Get user's behavioral events
-        events = db.query(BehavioralEvent).join(
-            BehavioralEvent.session
-        ).filter(
-            BehavioralEvent.event_type == "keystroke",
-            BehavioralEvent.session.has(user_id=user_id)
-        ).limit(100).all()
-        
-        if not events:
-            return {"profile": None, "message": "No keystroke data available"}
+        # Count the user's most recent keystroke events; all aggregation below runs in SQLite
+        event_count, sample_count, last_updated = DatabaseOperations.get_profile_summary(db, user_id, "keystroke")
         
-        # Aggregate features across all events
-        all_features = []
-        for event in events:
-            try:
-                features = json.loads(event.processed_features)
-                all_features.append(features)
-            except:
-                continue
+        if not event_count:
+            return {"profile": None, "message": "No keystroke data available"}
         
-        if not all_features:
+        if not sample_count:
             return {"profile": None, "message": "No valid feature data"}
         
-        # Calculate profile statistics
-        profile = KeystrokeProcessor.calculate_profile_statistics(all_features)
+        # Calculate profile statistics: promoted feature columns directly, the long tail via JSON1
+        profile = DatabaseOperations.get_json_feature_statistics(db, user_id, "keystroke", exclude=KEYSTROKE_FEATURE_COLUMNS)
+        profile.update(DatabaseOperations.get_feature_statistics(db, user_id, "keystroke", KEYSTROKE_FEATURE_COLUMNS))
         
         return {
             "profile": profile,
-            "sample_count": len(all_features),
-            "last_updated": events[-1].timestamp.isoformat()
+            "sample_count": sample_count,
+            "last_updated": last_updated.isoformat()
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Profile retrieval failed: {str(e)}")
-    
-    @staticmethod
-    def calculate_profile_statistics(feature_sets: List[Dict]) -> Dict:
-        """Calculate statistical profile from multiple feature sets"""
-        if not feature_sets:
-            return {}
-        
-        # Get all unique feature names
-        all_features = set()
-        for fs in feature_sets:
-            all_features.update(fs.keys())
-        
-        profile = {}
-        for feature in all_features:
-            values = [fs.get(feature, 0) for fs in feature_sets if feature in fs]
-            if values:
-                profile[f"{feature}_mean"] = np.mean(values)
-                profile[f"{feature}_std"] = np.std(values)
-                profile[f"{feature}_min"] = np.min(values)
-                profile[f"{feature}_max"] = np.max(values)
-        
-        return profile
\ No newline at end of file
@@ -1,14 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from ..database.db import get_db, DatabaseOperations
-from ..database.models import BehavioralEvent
+from starlette.concurrency import run_in_threadpool
+from ..database.db import get_db, DatabaseOperations, enqueue_behavioral_event
+from ..database.models import MOUSE_FEATURE_COLUMNS
+from ..utils.codec import encode_event_data
+from ..utils.jit import njit, NUMBA_AVAILABLE
+from ..utils.routing import ORJSONRoute
 from pydantic import BaseModel
-from typing import List, Dict, Any
-import json
+from typing import List, Dict, Any, Tuple
+import orjson
 import numpy as np
+from scipy.spatial.distance import pdist
 from datetime import datetime
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute)
 
 class MouseData(BaseModel):
     eventType: str
@@ -17,6 +22,72 @@ class MouseData(BaseModel):
     sessionToken: str
     timestamp: int
 
+# Move-velocity summary kernel: one compiled scan with Numba when available, NumPy otherwise.
+# Takes every move event's velocity (missing = 0); returns
+# (moving_n, velocity_mean, velocity_std, velocity_skewness, velocity_kurtosis, avg_jerk, pauses)
+# where the velocity moments cover only moving (velocity > 0) samples.
+if NUMBA_AVAILABLE:
+    @njit(cache=True, error_model='numpy')
+    def _mouse_kernel(velocities):
+        """Summarise move velocities (moments, jerk, pauses) in a single compiled scan"""
+        n = len(velocities)
+        moving_n = 0
+        moving_sum = 0.0
+        jerk_sum = 0.0
+        pauses = 0
+        for i in range(n):
+            v = velocities[i]
+            if v > 0:
+                moving_n += 1
+                moving_sum += v
+            if v < 0.1:  # Very slow = pause
+                pauses += 1
+            if i > 0:
+                jerk_sum += abs(v - velocities[i - 1])
+        
+        avg_jerk = jerk_sum / (n - 1) if n > 1 else np.nan
+        if not moving_n:
+            return 0, np.nan, np.nan, 0.0, 0.0, avg_jerk, pauses
+        
+        # Second pass for central moments (two-pass, like NumPy)
+        mean = moving_sum / moving_n
+        m2 = 0.0
+        m3 = 0.0
+        m4 = 0.0
+        for i in range(n):
+            v = velocities[i]
+            if v > 0:
+                d = v - mean
+                d2 = d * d
+                m2 += d2
+                m3 += d2 * d
+                m4 += d2 * d2
+        
+        std = np.sqrt(m2 / moving_n)
+        skewness = 0.0
+        kurtosis = 0.0
+        if std != 0:
+            if moving_n >= 3:
+                skewness = (m3 / moving_n) / std ** 3
+            if moving_n >= 4:
+                kurtosis = (m4 / moving_n) / std ** 4 - 3
+        return moving_n, mean, std, skewness, kurtosis, avg_jerk, pauses
+else:
+    def _mouse_kernel(velocities):
+        """Summarise move velocities (moments, jerk, pauses) with NumPy reductions"""
+        avg_jerk = np.abs(np.diff(velocities)).mean() if velocities.size > 1 else np.nan
+        pauses = int((velocities < 0.1).sum())  # Very slow = pause
+        moving = velocities[velocities > 0]
+        if not moving.size:
+            return 0, np.nan, np.nan, 0.0, 0.0, avg_jerk, pauses
+        
+        mean = moving.mean()
+        std = moving.std()
+        return (moving.size, mean, std,
+                MouseProcessor.calculate_skewness(moving, mean, std),
+                MouseProcessor.calculate_kurtosis(moving, mean, std),
+                avg_jerk, pauses)
+
 class MouseProcessor:
     
     @staticmethod
@@ -26,26 +97,33 @@ class MouseProcessor:
             return {}
         
         move_events = [e for e in raw_mouse_data if e.get('type') == 'move']
-        click_events = [e for e in raw_mouse_data if e.get('type') == 'click']
-        
         if len(move_events) < 5:
             return {}
         
+        click_events = [e for e in raw_mouse_data if e.get('type') == 'click']
+        
         features = {}
         
-        # Movement pattern features
-        velocities = [e['velocity'] for e in move_events if e.get('velocity', 0) > 0]
-        distances = [e['distance'] for e in move_events if e.get('distance', 0) > 0]
+        # Movement pattern features (per-move arrays are built once and shared below)
+        move_velocities = np.fromiter(
+            (e.get('velocity', 0) for e in move_events), dtype=np.float64, count=len(move_events)
+        )
+        move_distances = np.fromiter(
+            (e.get('distance', 0) for e in move_events), dtype=np.float64, count=len(move_events)
+        )
+        (moving_n, velocity_mean, velocity_std, velocity_skewness, velocity_kurtosis,
+         avg_jerk, pauses) = _mouse_kernel(move_velocities)
+        velocities = move_velocities[move_velocities > 0]
         
-        if velocities:
-            features['velocity_mean'] = np.mean(velocities)
-            features['velocity_std'] = np.std(velocities)
-            features['velocity_skewness'] = MouseProcessor.calculate_skewness(velocities)
-            features['velocity_kurtosis'] = MouseProcessor.calculate_kurtosis(velocities)
+        if moving_n:
+            features['velocity_mean'] = velocity_mean
+            features['velocity_std'] = velocity_std
+            features['velocity_skewness'] = velocity_skewness
+            features['velocity_kurtosis'] = velocity_kurtosis
         
         # Movement trajectory features
         features['path_efficiency'] = MouseProcessor.calculate_path_efficiency(move_events)
-        features['movement_smoothness'] = MouseProcessor.calculate_movement_smoothness(move_events)
+        features['movement_smoothness'] = 1.0 / (1.0 + avg_jerk)  # Lower jerk = smoother movement
         features['direction_consistency'] = MouseProcessor.calculate_direction_consistency(move_events)
         
         # Click pattern features
@@ -55,42 +133,44 @@ class MouseProcessor:
             features['click_duration_variance'] = MouseProcessor.calculate_click_variance(click_events)
         
         # Pause and hesitation patterns
-        features['pause_frequency'] = MouseProcessor.calculate_pause_frequency(move_events)
-        features['micro_movement_ratio'] = MouseProcessor.calculate_micro_movements(move_events)
+        features['pause_frequency'] = pauses / len(move_events)
+        features['micro_movement_ratio'] = MouseProcessor.calculate_micro_movements(move_distances)
         
         # Behavioral rhythm
-        features['movement_rhythm'] = MouseProcessor.calculate_movement_rhythm(move_events)
+        features['movement_rhythm'] = MouseProcessor.calculate_movement_rhythm(move_velocities)
         features['acceleration_pattern'] = MouseProcessor.calculate_acceleration_pattern(velocities)
         
         return features
     
     @staticmethod
-    def calculate_skewness(data: List[float]) -> float:
-        """Calculate skewness of data distribution"""
+    def calculate_skewness(data: List[float], mean: float = None, std: float = None) -> float:
+        """Calculate skewness of data distribution (pass mean/std if already known)"""
         if len(data) < 3:
             return 0.0
         
-        mean = np.mean(data)
-        std = np.std(data)
+        arr = np.asarray(data, dtype=np.float64)
+        mean = arr.mean() if mean is None else mean
+        std = arr.std() if std is None else std
         if std == 0:
             return 0.0
         
-        skewness = np.mean([((x - mean) / std) ** 3 for x in data])
-        return skewness
+        z = (arr - mean) / std
+        return (z ** 3).mean()
     
     @staticmethod
-    def calculate_kurtosis(data: List[float]) -> float:
-        """Calculate kurtosis of data distribution"""
+    def calculate_kurtosis(data: List[float], mean: float = None, std: float = None) -> float:
+        """Calculate kurtosis of data distribution (pass mean/std if already known)"""
         if len(data) < 4:
             return 0.0
         
-        mean = np.mean(data)
-        std = np.std(data)
+        arr = np.asarray(data, dtype=np.float64)
+        mean = arr.mean() if mean is None else mean
+        std = arr.std() if std is None else std
         if std == 0:
             return 0.0
         
-        kurtosis = np.mean([((x - mean) / std) ** 4 for x in data]) - 3
-        return kurtosis
+        z = (arr - mean) / std
+        return (z ** 4).mean() - 3
     
     @staticmethod
     def calculate_path_efficiency(move_events: List[Dict]) -> float:
@@ -111,46 +191,23 @@ class MouseProcessor:
         
         return direct_distance / total_distance
     
-    @staticmethod
-    def calculate_movement_smoothness(move_events: List[Dict]) -> float:
-        """Calculate smoothness of mouse movement"""
-        if len(move_events) < 3:
-            return 1.0
-        
-        velocities = [e.get('velocity', 0) for e in move_events]
-        
-        # Calculate velocity changes (jerk)
-        jerk_values = []
-        for i in range(1, len(velocities)):
-            jerk = abs(velocities[i] - velocities[i-1])
-            jerk_values.append(jerk)
-        
-        if not jerk_values:
-            return 1.0
-        
-        # Lower jerk = smoother movement
-        avg_jerk = np.mean(jerk_values)
-        smoothness = 1.0 / (1.0 + avg_jerk)
-        return smoothness
-    
     @staticmethod
     def calculate_direction_consistency(move_events: List[Dict]) -> float:
         """Calculate consistency in movement direction"""
-        directions = [e.get('direction', 0) for e in move_events if 'direction' in e]
+        directions = np.fromiter(
+            (e['direction'] for e in move_events if 'direction' in e), dtype=np.float64
+        )
         
-        if len(directions) < 2:
+        if directions.size < 2:
             return 1.0
         
         # Calculate direction changes
-        direction_changes = 0
-        for i in range(1, len(directions)):
-            angle_diff = abs(directions[i] - directions[i-1])
-            # Normalize angle difference to 0-180 range
-            angle_diff = min(angle_diff, 360 - angle_diff)
-            if angle_diff > 45:  # Significant direction change
-                direction_changes += 1
-        
-        consistency = 1.0 - (direction_changes / len(directions))
+        angle_diff = np.abs(np.diff(directions))
+        # Normalize angle difference to 0-180 range
+        angle_diff = np.minimum(angle_diff, 360 - angle_diff)
+        direction_changes = (angle_diff > 45).sum()  # Significant direction change
+        
+        consistency = 1.0 - (direction_changes / directions.size)
         return max(0.0, consistency)
     
     @staticmethod
@@ -160,17 +217,13 @@ class MouseProcessor:
             return 1.0
         
         # Calculate variance in click positions for similar targets
-        click_positions = [(e['x'], e['y']) for e in click_events]
-        
-        # Simple precision metric based on position clustering
-        total_variance = 0
-        for i in range(len(click_positions)):
-            for j in range(i+1, len(click_positions)):
-                distance = np.sqrt((click_positions[i][0] - click_positions[j][0])**2 + 
-                                 (click_positions[i][1] - click_positions[j][1])**2)
-                total_variance += distance
+        click_positions = np.fromiter(
+            (c for e in click_events for c in (e['x'], e['y'])),
+            dtype=np.float64, count=2 * len(click_events)
+        ).reshape(-1, 2)
         
-        avg_variance = total_variance / (len(click_positions) * (len(click_positions) - 1) / 2)
+        # Simple precision metric based on position clustering (mean pairwise distance)
+        avg_variance = pdist(click_positions).mean()
         precision = 1.0 / (1.0 + avg_variance / 100)  # Normalize
         return precision
     
@@ -194,49 +247,47 @@ class MouseProcessor:
         if len(click_events) < 2:
             return 0.0
         
-        intervals = []
-        for i in range(1, len(click_events)):
-            interval = click_events[i]['timestamp'] - click_events[i-1]['timestamp']
-            intervals.append(interval)
-        
-        return np.var(intervals) if intervals else 0.0
+        timestamps = np.fromiter(
+            (e['timestamp'] for e in click_events), dtype=np.float64, count=len(click_events)
+        )
+        return np.diff(timestamps).var()
     
     @staticmethod
-    def calculate_pause_frequency(move_events: List[Dict]) -> float:
-        """Calculate frequency of movement pauses"""
-        if len(move_events) < 5:
+    def calculate_micro_movements(distances: np.ndarray) -> float:
+        """Calculate ratio of micro movements (very small distances)"""
+        if not len(distances):
             return 0.0
         
-        pauses = 0
-        for event in move_events:
-            if event.get('velocity', 0) < 0.1:  # Very slow = pause
-                pauses += 1
-        
-        return pauses / len(move_events)
+        return (distances < 5).mean()
     
     @staticmethod
-    def calculate_micro_movements(move_events: List[Dict]) -> float:
-        """Calculate ratio of micro movements (very small distances)"""
-        if not move_events:
+    def calculate_movement_rhythm(velocities: np.ndarray) -> float:
+        """Calculate rhythmic patterns in movement from per-move velocities"""
+        n = len(velocities)
+        if n < 10:
             return 0.0
         
-        micro_movements = sum(1 for e in move_events if e.get('distance', 0) < 5)
-        return micro_movements / len(move_events)
-    
-    @staticmethod
-    def calculate_movement_rhythm(move_events: List[Dict]) -> float:
-        """Calculate rhythmic patterns in movement"""
-        velocities = [e.get('velocity', 0) for e in move_events]
+        # Simple rhythm detection using velocity autocorrelation: Pearson correlation of
+        # velocities[:-lag] vs velocities[lag:] for every lag at once. Lagged products come
+        # from one FFT (Wiener-Khinchin); segment sums come from prefix sums.
+        lags = np.arange(1, min(10, n // 2))
+        spectrum = np.fft.rfft(velocities, n=2 * n)
+        lagged_products = np.fft.irfft(spectrum * np.conj(spectrum), n=2 * n)[lags]
         
-        if len(velocities) < 10:
-            return 0.0
+        csum = np.concatenate(([0.0], np.cumsum(velocities)))
+        csum_sq = np.concatenate(([0.0], np.cumsum(velocities * velocities)))
+        m = n - lags
+        sum_head, sum_tail = csum[m], csum[n] - csum[lags]
+        sq_head, sq_tail = csum_sq[m], csum_sq[n] - csum_sq[lags]
+        
+        cov = lagged_products - sum_head * sum_tail / m
+        var_head = sq_head - sum_head ** 2 / m
+        var_tail = sq_tail - sum_tail ** 2 / m
         
-        # Simple rhythm detection using velocity autocorrelation
-        rhythm_score = 0.0
-        for lag in range(1, min(10, len(velocities)//2)):
-            correlation = np.corrcoef(velocities[:-lag], velocities[lag:])[0, 1]
-            if not np.isnan(correlation):
-                rhythm_score += abs(correlation)
+        # Constant segments have no defined correlation; skip them like NaNs
+        valid = (var_head > 1e-12 * sq_head) & (var_tail > 1e-12 * sq_tail)
+        correlation = np.clip(cov[valid] / np.sqrt(var_head[valid] * var_tail[valid]), -1.0, 1.0)
+        rhythm_score = np.abs(correlation).sum()
         
         return rhythm_score / 9  # Normalize by number of lags tested
     
@@ -246,19 +297,36 @@ class MouseProcessor:
         if len(velocities) < 3:
             return 0.0
         
-        accelerations = []
-        for i in range(1, len(velocities)):
-            acceleration = velocities[i] - velocities[i-1]
-            accelerations.append(acceleration)
-        
-        if not accelerations:
-            return 0.0
-        
         # Consistency measured as inverse of acceleration variance
-        acc_variance = np.var(accelerations)
+        acc_variance = np.diff(np.asarray(velocities, dtype=np.float64)).var()
         consistency = 1.0 / (1.0 + acc_variance)
         return consistency
 
+def _process_mouse_data_sync(data: MouseData, db: Session) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """Blocking part of process_mouse_data: session lookup, feature extraction and row encoding"""
+    # Get session from token
+    session = DatabaseOperations.get_active_session(db, data.sessionToken)
+    if not session:
+        raise HTTPException(status_code=401, detail="Invalid session token")
+    
+    # Extract advanced features
+    advanced_features = MouseProcessor.extract_advanced_features(data.rawData)
+    
+    # Combine with basic features
+    all_features = {**data.features, **advanced_features}
+    
+    # Encode the behavioral event row
+    behavioral_event = {
+        "session_id": session.id,
+        "event_type": "mouse",
+        "event_data": encode_event_data(data.rawData),
+        "processed_features": orjson.dumps(all_features, option=orjson.OPT_SERIALIZE_NUMPY).decode(),
+        "timestamp": datetime.fromtimestamp(data.timestamp / 1000),
+        **{name: all_features.get(name) for name in MOUSE_FEATURE_COLUMNS}
+    }
+    
+    return behavioral_event, all_features
+
 @router.post("/mouse")
 async def process_mouse_data(
     data: MouseData,
@@ -266,34 +334,16 @@ async def process_mouse_data(
 ):
     """Process incoming mouse behavioral data"""
     try:
-        # Get session from token
-        session = DatabaseOperations.get_active_session(db, data.sessionToken)
-        if not session:
-            raise HTTPException(status_code=401, detail="Invalid session token")
-        
-        # Extract advanced features
-        advanced_features = MouseProcessor.extract_advanced_features(data.rawData)
-        
-        # Combine with basic features
-        all_features = {**data.features, **advanced_features}
-        
-        # Store behavioral event
-        behavioral_event = BehavioralEvent(
-            session_id=session.id,
-            event_type="mouse",
-            event_data=json.dumps(data.rawData),
-            processed_features=json.dumps(all_features),
-            timestamp=datetime.fromtimestamp(data.timestamp / 1000)
-        )
+        # Feature extraction is CPU-bound; keep it off the event loop
+        behavioral_event, all_features = await run_in_threadpool(_process_mouse_data_sync, data, db)
         
-        db.add(behavioral_event)
-        db.commit()
+        # Store behavioral event (written in batches by behavioral_event_flush_loop)
+        await enqueue_behavioral_event(behavioral_event)
         
         return {
             "status": "success",
             "message": f"Processed {len(data.rawData)} mouse events",
-            "features_extracted": len(all_features),
-            "event_id": behavioral_event.id
+            "features_extracted": len(all_features)
         }
         
     except Exception as e:
@@ -306,59 +356,24 @@ async def get_mouse_profile(
 ):
     """Get mouse behavioral profile for a user"""
     try:
-        # Get user's mouse behavioral events
-        events = db.query(BehavioralEvent).join(
-            BehavioralEvent.session
-        ).filter(
-            BehavioralEvent.event_type == "mouse",
-            BehavioralEvent.session.has(user_id=user_id)
-        ).limit(100).all()
-        
-        if not events:
-            return {"profile": None, "message": "No mouse data available"}
+        # Count the user's most recent mouse events; all aggregation below runs in SQLite
+        event_count, sample_count, last_updated = DatabaseOperations.get_profile_summary(db, user_id, "mouse")
         
-        # Aggregate features across all events
-        all_features = []
-        for event in events:
-            try:
-                features = json.loads(event.processed_features)
-                all_features.append(features)
-            except:
-                continue
+        if not event_count:
+            return {"profile": None, "message": "No mouse data available"}
         
-        if not all_features:
+        if not sample_count:
             return {"profile": None, "message": "No valid feature data"}
         
-        # Calculate profile statistics
-        profile = MouseProcessor.calculate_profile_statistics(all_features)
+        # Calculate profile statistics: promoted feature columns directly, the long tail via JSON1
+        profile = DatabaseOperations.get_json_feature_statistics(db, user_id, "mouse", exclude=MOUSE_FEATURE_COLUMNS)
+        profile.update(DatabaseOperations.get_feature_statistics(db, user_id, "mouse", MOUSE_FEATURE_COLUMNS))
         
         return {
             "profile": profile,
-            "sample_count": len(all_features),
-            "last_updated": events[-1].timestamp.isoformat()
+            "sample_count": sample_count,
+            "last_updated": last_updated.isoformat()
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Profile retrieval failed: {str(e)}")
-    
-    @staticmethod
-    def calculate_profile_statistics(feature_sets: List[Dict]) -> Dict:
-        """Calculate statistical profile from multiple feature sets"""
-        if not feature_sets:
-            return {}
-        
-        # Get all unique feature names
-        all_features = set()
-        for fs in feature_sets:
-            all_features.update(fs.keys())
-        
-        profile = {}
-        for feature in all_features:
-            values = [fs.get(feature, 0) for fs in feature_sets if feature in fs]
-            if values:
-                profile[f"{feature}_mean"] = np.mean(values)
-                profile[f"{feature}_std"] = np.std(values)
-                profile[f"{feature}_min"] = np.min(values)
-                profile[f"{feature}_max"] = np.max(values)
-        
-        return profile
\ No newline at end of file
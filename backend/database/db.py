@@ -1,19 +1,53 @@
-from sqlalchemy import create_engine
+from sqlalchemy import DateTime, Integer, bindparam, create_engine, event, func, insert, inspect, or_, select, text
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
-from backend.database.models import Base, User, BehavioralProfile, UserSession, BehavioralEvent
+from starlette.concurrency import run_in_threadpool
+from cachetools import TTLCache
+from backend.database.models import (
+    Base, User, BehavioralProfile, UserSession, BehavioralEvent, KEYSTROKE_FEATURE_COLUMNS, MOUSE_FEATURE_COLUMNS
+)
+import asyncio
+import logging
 import os
+import threading
+from collections import deque
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
 
 # Database Configuration
 DATABASE_URL = "sqlite:///./sentinelx.db"
 
+# Connection pool sizing for concurrent request handlers
+DB_POOL_SIZE = 20
+DB_MAX_OVERFLOW = 10
+DB_POOL_TIMEOUT_SECONDS = 30
+DB_POOL_RECYCLE_SECONDS = 3600
+
 # Create database engine
 engine = create_engine(
     DATABASE_URL, 
-    connect_args={"check_same_thread": False}  # Needed for SQLite
+    connect_args={"check_same_thread": False},  # Needed for SQLite
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=True  # Drop stale pooled connections instead of failing the request
 )
 
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """Enable WAL and relaxed fsync so behavioral writes don't serialize on the rollback journal"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -22,6 +56,50 @@ def create_tables():
     Base.metadata.create_all(bind=engine)
     print("✅ Database tables created successfully")
 
+# Promoted behavioral_events feature column -> event type whose processed_features JSON holds it
+_PROMOTED_FEATURE_EVENT_TYPES = {
+    **{name: "keystroke" for name in KEYSTROKE_FEATURE_COLUMNS},
+    **{name: "mouse" for name in MOUSE_FEATURE_COLUMNS}
+}
+
+def _backfill_promoted_feature(conn, name: str):
+    """Copy a newly added feature column's value out of each older row's processed_features JSON"""
+    # Invalid JSON and non-numeric values stay NULL, matching what the write path would store
+    conn.execute(text(f"""
+        UPDATE behavioral_events
+        SET {name} = CASE WHEN json_valid(processed_features) THEN
+                         CASE WHEN json_type(processed_features, '$.{name}') IN ('integer', 'real')
+                              THEN json_extract(processed_features, '$.{name}') END
+                     END
+        WHERE {name} IS NULL AND event_type = :event_type
+    """), {"event_type": _PROMOTED_FEATURE_EVENT_TYPES[name]})
+
+def add_missing_columns() -> List[str]:
+    """Add model columns missing from existing tables (create_all never alters a table); returns them"""
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                # Only nullable columns are added this way; SQLite backfills them with NULL
+                column_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                if table.name == BehavioralEvent.__tablename__ and column.name in _PROMOTED_FEATURE_EVENT_TYPES:
+                    _backfill_promoted_feature(conn, column.name)
+                added.append(f"{table.name}.{column.name}")
+    return added
+
+def create_missing_indexes():
+    """Create model indexes missing from existing tables (create_all only indexes tables it creates)"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 def get_db():
     """Dependency to get database session"""
     db = SessionLocal()
@@ -34,10 +112,240 @@ def init_database():
     """Initialize database with tables"""
     try:
         create_tables()
+        added_columns = add_missing_columns()
+        if added_columns:
+            print(f"🔧 Added missing columns: {', '.join(added_columns)}")
+        create_missing_indexes()
         print("🗄️ Database initialized successfully")
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
 
+# Hot statements built once at import so SQLAlchemy's compiled cache always hits
+_active_session_stmt = select(UserSession).where(
+    UserSession.session_token == bindparam("session_token"),
+    UserSession.is_active.is_(True)
+)
+_insert_behavioral_events_stmt = insert(BehavioralEvent.__table__)
+
+# A user's most recent events of one type, shared by the profile aggregation queries
+_RECENT_EVENTS_CTE = """
+    recent AS (
+        SELECT be.processed_features, be.timestamp
+        FROM behavioral_events be
+        JOIN user_sessions us ON be.session_id = us.id
+        WHERE us.user_id = :user_id AND be.event_type = :event_type
+        ORDER BY be.timestamp DESC
+        LIMIT :limit
+    )
+"""
+
+_profile_summary_stmt = text(f"""
+    WITH {_RECENT_EVENTS_CTE}
+    SELECT COUNT(*) AS event_count,
+           COALESCE(SUM(json_valid(processed_features)), 0) AS sample_count,
+           MAX(timestamp) AS last_updated
+    FROM recent
+""").columns(event_count=Integer, sample_count=Integer, last_updated=DateTime)
+
+# Per-key aggregates over every numeric value in processed_features via SQLite JSON1;
+# invalid JSON rows are treated as empty objects, matching the Python-side decode skip
+_json_feature_stats_stmt = text(f"""
+    WITH {_RECENT_EVENTS_CTE},
+    features AS (
+        SELECT j.key AS name, j.value AS value
+        FROM recent,
+             json_each(CASE WHEN json_valid(recent.processed_features)
+                            THEN recent.processed_features ELSE '{{}}' END) AS j
+        WHERE j.type IN ('integer', 'real') AND j.key NOT IN :exclude
+    ),
+    means AS (
+        SELECT name, AVG(value) AS mean FROM features GROUP BY name
+    )
+    SELECT f.name, m.mean, AVG((f.value - m.mean) * (f.value - m.mean)) AS variance,
+           MIN(f.value), MAX(f.value)
+    FROM features f
+    JOIN means m ON f.name = m.name
+    GROUP BY f.name
+""").bindparams(bindparam("exclude", expanding=True))
+
+# Behavioral event write queue: handlers enqueue row dicts, a background task inserts in batches
+EVENT_BATCH_SIZE = 500
+EVENT_FLUSH_INTERVAL_SECONDS = 0.1
+EVENT_QUEUE_MAX_SIZE = 10_000
+
+# asyncio queues bind to the loop that first waits on them, so each app lifespan opens its own
+_event_queue: "Optional[asyncio.Queue[Dict[str, Any]]]" = None
+
+def open_behavioral_event_queue() -> "asyncio.Queue[Dict[str, Any]]":
+    """Create the event queue for the running loop; handlers enqueue into it until it is flushed"""
+    global _event_queue
+    _event_queue = asyncio.Queue(maxsize=EVENT_QUEUE_MAX_SIZE)
+    return _event_queue
+
+async def enqueue_behavioral_event(behavioral_event: Dict[str, Any]):
+    """Queue a behavioral_events row (column -> value) for the next batched insert (waits if the queue is full)"""
+    event_queue = _event_queue
+    if event_queue is None:
+        # No lifespan running the flush loop (e.g. a bare TestClient): write it straight away
+        await run_in_threadpool(write_behavioral_events, [behavioral_event])
+        return
+    await event_queue.put(behavioral_event)
+
+# Failed inserts are retried ahead of later batches; rows that exhaust their attempts move to a
+# bounded dead-letter buffer (drained by operators) instead of being dropped
+EVENT_WRITE_MAX_ATTEMPTS = 3
+EVENT_RETRY_INTERVAL_SECONDS = 1.0
+EVENT_DEAD_LETTER_MAX_SIZE = 10_000
+
+_event_retry_batches: "deque[Tuple[int, List[Dict[str, Any]]]]" = deque()
+_event_dead_letter: "deque[Dict[str, Any]]" = deque(maxlen=EVENT_DEAD_LETTER_MAX_SIZE)
+_event_write_failures = 0
+_event_write_lock = threading.Lock()
+
+def _insert_behavioral_events(batch: List[Dict[str, Any]]) -> bool:
+    """Insert a batch of behavioral events in a single Core executemany, bypassing the ORM flush"""
+    # executemany needs one key set; keystroke and mouse rows fill different feature columns
+    columns = set().union(*batch)
+    rows = [{column: row.get(column) for column in columns} for row in batch]
+    
+    db = SessionLocal()
+    try:
+        db.execute(_insert_behavioral_events_stmt, rows)
+        db.commit()
+        return True
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Failed to write {len(batch)} behavioral events: {str(e)}")
+        return False
+    finally:
+        db.close()
+
+def _keep_failed_events(batch: List[Dict[str, Any]], attempts: int):
+    """Queue a failed batch for retry, or dead-letter it once it has used its attempts"""
+    global _event_write_failures
+    with _event_write_lock:
+        _event_write_failures += 1
+        if attempts < EVENT_WRITE_MAX_ATTEMPTS:
+            _event_retry_batches.append((attempts, batch))
+        else:
+            _event_dead_letter.extend(batch)
+            logger.error(f"Dead-lettered {len(batch)} behavioral events after {attempts} failed writes")
+
+def write_behavioral_events(batch: List[Dict[str, Any]]) -> int:
+    """Insert a batch (after any earlier failed batches awaiting retry); returns rows written"""
+    with _event_write_lock:
+        pending = list(_event_retry_batches)
+        _event_retry_batches.clear()
+    if batch:
+        pending.append((0, batch))
+    
+    written = 0
+    for attempts, rows in pending:
+        if _insert_behavioral_events(rows):
+            written += len(rows)
+        elif attempts + 1 < EVENT_WRITE_MAX_ATTEMPTS or len(rows) == 1:
+            _keep_failed_events(rows, attempts + 1)
+        else:
+            # Last attempt: fall back to one row at a time so a poison row doesn't take the
+            # valid events of its batch into the dead letters with it
+            failed = [row for row in rows if not _insert_behavioral_events([row])]
+            written += len(rows) - len(failed)
+            if failed:
+                _keep_failed_events(failed, attempts + 1)
+    return written
+
+def has_pending_event_retries() -> bool:
+    """Whether failed batches are waiting to be written again"""
+    with _event_write_lock:
+        return bool(_event_retry_batches)
+
+def drain_dead_letter_events() -> List[Dict[str, Any]]:
+    """Remove and return the dead-lettered rows, e.g. to replay them once the database is fixed"""
+    with _event_write_lock:
+        rows = list(_event_dead_letter)
+        _event_dead_letter.clear()
+    return rows
+
+def get_event_write_stats() -> Dict[str, int]:
+    """Failed event writes since startup and rows awaiting retry or in the dead-letter buffer"""
+    with _event_write_lock:
+        return {
+            "event_write_failures": _event_write_failures,
+            "events_pending_retry": sum(len(rows) for _, rows in _event_retry_batches),
+            "events_dead_lettered": len(_event_dead_letter)
+        }
+
+def flush_behavioral_events() -> int:
+    """Close the event queue, then write everything still in it, using up pending retries (used on shutdown)"""
+    global _event_queue
+    event_queue, _event_queue = _event_queue, None
+    batch = []
+    while event_queue is not None and not event_queue.empty():
+        batch.append(event_queue.get_nowait())
+    written = write_behavioral_events(batch)
+    while has_pending_event_retries():
+        written += write_behavioral_events([])
+    
+    unwritten = get_event_write_stats()["events_dead_lettered"]
+    if unwritten:
+        logger.error(f"{unwritten} behavioral events could not be written and remain dead-lettered")
+    return written
+
+async def behavioral_event_flush_loop(
+    event_queue: "asyncio.Queue[Dict[str, Any]]",
+    batch_size: int = EVENT_BATCH_SIZE,
+    interval: float = EVENT_FLUSH_INTERVAL_SECONDS
+):
+    """Background task that writes `event_queue` every `interval` seconds or `batch_size` events"""
+    loop = asyncio.get_running_loop()
+    batch = []
+    try:
+        while True:
+            if has_pending_event_retries():
+                # Don't let failed batches wait for new traffic before they are retried
+                try:
+                    batch = [await asyncio.wait_for(event_queue.get(), EVENT_RETRY_INTERVAL_SECONDS)]
+                except asyncio.TimeoutError:
+                    await run_in_threadpool(write_behavioral_events, [])
+                    continue
+            else:
+                batch = [await event_queue.get()]
+            deadline = loop.time() + interval
+            while len(batch) < batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(event_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            pending, batch = batch, []
+            await run_in_threadpool(write_behavioral_events, pending)
+    except asyncio.CancelledError:
+        # Don't drop a partially collected batch on shutdown
+        write_behavioral_events(batch)
+        raise
+
+# Active session lookup cache (token -> detached UserSession row). Entries are dropped
+# whenever trust score or active state changes, so the TTL only bounds other drift.
+ACTIVE_SESSION_CACHE_SIZE = 10_000
+ACTIVE_SESSION_CACHE_TTL_SECONDS = 60
+
+_active_session_cache = TTLCache(maxsize=ACTIVE_SESSION_CACHE_SIZE, ttl=ACTIVE_SESSION_CACHE_TTL_SECONDS)
+_active_session_cache_lock = threading.Lock()
+
+def invalidate_active_session(session_token: str):
+    """Drop a cached session row, e.g. after its trust score or active flag changed"""
+    with _active_session_cache_lock:
+        _active_session_cache.pop(session_token, None)
+
+def invalidate_user_sessions(user_id: int):
+    """Drop every cached session row belonging to a user"""
+    with _active_session_cache_lock:
+        for session_token in [t for t, s in _active_session_cache.items() if s.user_id == user_id]:
+            _active_session_cache.pop(session_token, None)
+
 # Database Operations
 class DatabaseOperations:
     
@@ -64,6 +372,16 @@ class DatabaseOperations:
         """Get user by email"""
         return db.query(User).filter(User.email == email).first()
     
+    @staticmethod
+    def check_user_exists(db: Session, username: str, email: str) -> Tuple[bool, bool]:
+        """Check username and email availability in one query; returns (username_taken, email_taken)"""
+        rows = db.query(User.username, User.email).filter(
+            or_(User.username == username, User.email == email)
+        ).all()
+        username_taken = any(row.username == username for row in rows)
+        email_taken = any(row.email == email for row in rows)
+        return username_taken, email_taken
+    
     @staticmethod
     def create_session(db: Session, user_id: int, session_token: str, ip_address: str = None, user_agent: str = None):
         """Create a new user session"""
@@ -78,13 +396,109 @@ class DatabaseOperations:
         db.refresh(db_session)
         return db_session
     
+    @staticmethod
+    def _get_cached_active_session(db: Session, session_token: str) -> Optional[UserSession]:
+        """Detached active session row for a token, served from the TTL cache when recently seen"""
+        with _active_session_cache_lock:
+            cached_session = _active_session_cache.get(session_token)
+        
+        if cached_session is None:
+            session = db.execute(
+                _active_session_stmt, {"session_token": session_token}
+            ).scalar_one_or_none()
+            if session is None:
+                return None
+            db.expunge(session)
+            with _active_session_cache_lock:
+                _active_session_cache[session_token] = session
+            cached_session = session
+        
+        return cached_session
+    
     @staticmethod
     def get_active_session(db: Session, session_token: str):
-        """Get active session by token"""
-        return db.query(UserSession).filter(
-            UserSession.session_token == session_token,
-            UserSession.is_active == True
-        ).first()
+        """Get active session by token, serving recently seen rows from the TTL cache"""
+        cached_session = DatabaseOperations._get_cached_active_session(db, session_token)
+        if cached_session is None:
+            return None
+        return db.merge(cached_session, load=False)
+    
+    @staticmethod
+    def get_active_session_id(db: Session, session_token: str) -> Optional[int]:
+        """Resolve an active session token to its id without attaching the row to `db`"""
+        cached_session = DatabaseOperations._get_cached_active_session(db, session_token)
+        return cached_session.id if cached_session is not None else None
+    
+    @staticmethod
+    def get_recent_session_user_ids(db: Session, since: datetime) -> List[int]:
+        """Users with session activity at or after `since`"""
+        rows = db.query(UserSession.user_id).filter(
+            UserSession.last_activity >= since
+        ).distinct().all()
+        return [row.user_id for row in rows]
+    
+    @staticmethod
+    def get_feature_statistics(db: Session, user_id: int, event_type: str,
+                               columns: Sequence[str], limit: int = 100) -> Dict[str, float]:
+        """Aggregate promoted feature columns over a user's most recent events in one SQL query"""
+        recent = db.query(
+            *[getattr(BehavioralEvent, name) for name in columns]
+        ).join(
+            UserSession, BehavioralEvent.session_id == UserSession.id
+        ).filter(
+            UserSession.user_id == user_id,
+            BehavioralEvent.event_type == event_type
+        ).order_by(BehavioralEvent.timestamp.desc()).limit(limit).cte("recent_events")
+        
+        # Centred second moment against each column's mean (two-pass, like np.std);
+        # SQLite has no STDDEV and E[x^2] - E[x]^2 loses precision on near-constant columns
+        aggregates = []
+        for name in columns:
+            col = recent.c[name]
+            mean = select(func.avg(col)).scalar_subquery()
+            aggregates.extend([
+                func.count(col), func.avg(col), func.avg((col - mean) * (col - mean)),
+                func.min(col), func.max(col)
+            ])
+        row = db.query(*aggregates).one()
+        
+        stats = {}
+        for i, name in enumerate(columns):
+            count, mean, variance, min_, max_ = row[5 * i:5 * i + 5]
+            if not count:
+                continue
+            stats[f"{name}_mean"] = mean
+            stats[f"{name}_std"] = variance ** 0.5
+            stats[f"{name}_min"] = min_
+            stats[f"{name}_max"] = max_
+        return stats
+    
+    @staticmethod
+    def get_profile_summary(db: Session, user_id: int, event_type: str,
+                            limit: int = 100) -> Tuple[int, int, Optional[datetime]]:
+        """Count a user's recent events and decodable feature rows; returns (events, samples, last_updated)"""
+        row = db.execute(
+            _profile_summary_stmt, {"user_id": user_id, "event_type": event_type, "limit": limit}
+        ).one()
+        return row.event_count, row.sample_count, row.last_updated
+    
+    @staticmethod
+    def get_json_feature_statistics(db: Session, user_id: int, event_type: str,
+                                    exclude: Sequence[str] = (), limit: int = 100) -> Dict[str, float]:
+        """Aggregate every numeric processed_features key in SQL (JSON1), skipping `exclude`"""
+        rows = db.execute(_json_feature_stats_stmt, {
+            "user_id": user_id, "event_type": event_type, "limit": limit,
+            # NOT IN () is invalid SQL; an impossible key keeps the list non-empty
+            "exclude": list(exclude) or [""]
+        })
+        
+        stats = {}
+        for name, mean, variance, min_, max_ in rows:
+            stats[f"{name}_mean"] = mean
+            stats[f"{name}_std"] = variance ** 0.5
+            stats[f"{name}_min"] = min_
+            stats[f"{name}_max"] = max_
+        return stats
     
     @staticmethod
     def update_trust_score(db: Session, session_id: int, new_trust_score: float):
@@ -93,6 +507,7 @@ class DatabaseOperations:
         if session:
             session.current_trust_score = new_trust_score
             db.commit()
+            invalidate_active_session(session.session_token)
         return session
 
 if __name__ == "__main__":
@@ -1,10 +1,23 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 Base = declarative_base()
 
+# Numerical features promoted out of the processed_features JSON into typed
+# BehavioralEvent columns so profiles can aggregate them in SQL
+KEYSTROKE_FEATURE_COLUMNS = (
+    'avg_dwell_time', 'std_dwell_time', 'avg_flight_time', 'std_flight_time',
+    'typing_rhythm_variance', 'pressure_consistency', 'typing_cadence',
+    'special_key_ratio', 'error_correction_rate'
+)
+MOUSE_FEATURE_COLUMNS = (
+    'velocity_mean', 'velocity_std', 'path_efficiency', 'movement_smoothness',
+    'direction_consistency', 'pause_frequency', 'micro_movement_ratio',
+    'movement_rhythm', 'acceleration_pattern'
+)
+
 class User(Base):
     __tablename__ = "users"
     
@@ -47,8 +60,8 @@ class UserSession(Base):
     __tablename__ = "user_sessions"
     
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    session_token = Column(String(255), unique=True, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    session_token = Column(String(64), unique=True, nullable=False)  # 32 chars; headroom for legacy 43-char tokens
     
     # Trust Scoring
     initial_trust_score = Column(Float, default=1.0)
@@ -65,6 +78,10 @@ class UserSession(Base):
     # Relationships
     user = relationship("User", back_populates="sessions")
     behavioral_events = relationship("BehavioralEvent", back_populates="session")
+    
+    __table_args__ = (
+        Index("ix_sessions_token_active", "session_token", "is_active"),
+    )
 
 class BehavioralEvent(Base):
     __tablename__ = "behavioral_events"
@@ -74,9 +91,31 @@ class BehavioralEvent(Base):
     
     # Event Data
     event_type = Column(String(20))  # 'keystroke' or 'mouse'
-    event_data = Column(Text)  # JSON string of raw event data
+    event_data = Column(LargeBinary)  # zstd-compressed MessagePack of raw event data (legacy rows: JSON text)
     processed_features = Column(Text)  # JSON string of extracted features
     
+    # Promoted Keystroke Features (see KEYSTROKE_FEATURE_COLUMNS)
+    avg_dwell_time = Column(Float)
+    std_dwell_time = Column(Float)
+    avg_flight_time = Column(Float)
+    std_flight_time = Column(Float)
+    typing_rhythm_variance = Column(Float)
+    pressure_consistency = Column(Float)
+    typing_cadence = Column(Float)
+    special_key_ratio = Column(Float)
+    error_correction_rate = Column(Float)
+    
+    # Promoted Mouse Features (see MOUSE_FEATURE_COLUMNS)
+    velocity_mean = Column(Float)
+    velocity_std = Column(Float)
+    path_efficiency = Column(Float)
+    movement_smoothness = Column(Float)
+    direction_consistency = Column(Float)
+    pause_frequency = Column(Float)
+    micro_movement_ratio = Column(Float)
+    movement_rhythm = Column(Float)
+    acceleration_pattern = Column(Float)
+    
     # Anomaly Detection
     anomaly_score = Column(Float)
     is_anomalous = Column(Boolean, default=False)
@@ -85,4 +124,8 @@ class BehavioralEvent(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
-    session = relationship("UserSession", back_populates="behavioral_events")
\ No newline at end of file
+    session = relationship("UserSession", back_populates="behavioral_events")
+    
+    __table_args__ = (
+        Index("ix_be_session_type_ts", "session_id", "event_type", "timestamp"),
+    )
\ No newline at end of file
@@ -1,73 +1,175 @@
-from fastapi import FastAPI, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 from contextlib import asynccontextmanager
-import json
 import asyncio
+import functools
+import hashlib
+import orjson
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from typing import Dict, List
 
 # Import routers and dependencies
 from backend.auth.login import router as auth_router, get_current_user
+from backend.auth.verify import activity_flush_loop, flush_activity_buffer, record_session_activity
 from backend.behavior.keystroke import router as keystroke_router
 from backend.behavior.mouse import router as mouse_router
-from backend.database.db import get_db, init_database
-from backend.database.models import User
-from backend.trust.trust_engine import trust_engine
-from backend.ml.predict import predictor
+from backend.database.db import (
+    DatabaseOperations, SessionLocal, behavioral_event_flush_loop, flush_behavioral_events, get_db,
+    get_event_write_stats, init_database, open_behavioral_event_queue
+)
+from backend.database.models import User, UserSession
+from backend.trust.trust_engine import SecurityAction, trust_engine, warm_trust_kernels
+from backend.utils.routing import ORJSONRoute
+from backend.ml.predict import predictor, warm_prediction_kernels
+from backend.ml.train_model import BehavioralAnomalyDetector
+
+# numpy scalars/arrays come straight out of the predictor; non-str keys mirror json.dumps
+WS_JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def _encode_ws_message(message: dict) -> str:
+    # Text frames: the dashboard JSON.parses event.data, which binary frames would break
+    return orjson.dumps(message, option=WS_JSON_OPTIONS).decode()
+
+# Static envelope of trust updates, spliced around the serialized payload
+_TRUST_UPDATE_PREFIX = b'{"type":"trust_update","data":'
+_ENVELOPE_SUFFIX = b'}'
+
+def _encode_trust_update(trust_result: dict) -> str:
+    return (_TRUST_UPDATE_PREFIX + orjson.dumps(trust_result, option=WS_JSON_OPTIONS) + _ENVELOPE_SUFFIX).decode()
+
+# WebSocket connections are sharded by token hash (power of two for masking)
+WS_SHARD_COUNT = 16
 
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+        # Per-shard locks serialize mutation only; reads and broadcasts work off snapshots.
+        # Keys are the token strings themselves: str caches its hash, and hashing a fresh
+        # 32-char token is cheaper than deriving a digest key on every lookup
+        self.shards: List[Dict[str, WebSocket]] = [{} for _ in range(WS_SHARD_COUNT)]
+        self.locks: List[asyncio.Lock] = [asyncio.Lock() for _ in range(WS_SHARD_COUNT)]
+        self._active_count = 0  # Maintained on connect/disconnect for O(1) metrics
+    
+    @staticmethod
+    def _shard_index(session_token: str) -> int:
+        return hash(session_token) & (WS_SHARD_COUNT - 1)
     
     async def connect(self, websocket: WebSocket, session_token: str):
         await websocket.accept()
-        self.active_connections[session_token] = websocket
+        idx = self._shard_index(session_token)
+        async with self.locks[idx]:
+            if session_token not in self.shards[idx]:
+                self._active_count += 1
+            self.shards[idx][session_token] = websocket
+    
+    async def disconnect(self, session_token: str):
+        idx = self._shard_index(session_token)
+        async with self.locks[idx]:
+            if self.shards[idx].pop(session_token, None) is not None:
+                self._active_count -= 1
     
-    def disconnect(self, session_token: str):
-        if session_token in self.active_connections:
-            del self.active_connections[session_token]
+    def connection_count(self) -> int:
+        return self._active_count
     
     async def send_personal_message(self, message: dict, session_token: str):
-        if session_token in self.active_connections:
+        await self._send_personal(_encode_ws_message, message, session_token)
+    
+    async def send_trust_update(self, trust_result: dict, session_token: str):
+        await self._send_personal(_encode_trust_update, trust_result, session_token)
+    
+    async def _send_personal(self, encode, payload: dict, session_token: str):
+        # Serialize only when the session actually has a socket
+        connection = self.shards[self._shard_index(session_token)].get(session_token)
+        if connection is not None:
             try:
-                await self.active_connections[session_token].send_text(json.dumps(message))
+                await connection.send_text(encode(payload))
             except:
-                self.disconnect(session_token)
+                await self.disconnect(session_token)
     
     async def broadcast(self, message: dict):
-        disconnected = []
-        for session_token, connection in self.active_connections.items():
-            try:
-                await connection.send_text(json.dumps(message))
-            except:
-                disconnected.append(session_token)
+        # Serialize once and fan out concurrently so one slow client can't stall the rest
+        payload = _encode_ws_message(message)
+        connections = [item for shard in self.shards for item in list(shard.items())]
+        results = await asyncio.gather(
+            *[connection.send_text(payload) for _, connection in connections],
+            return_exceptions=True
+        )
         
-        for session_token in disconnected:
-            self.disconnect(session_token)
+        for (session_token, _), result in zip(connections, results):
+            if isinstance(result, Exception):
+                await self.disconnect(session_token)
 
 manager = ConnectionManager()
 
+# Warm-load models of recently active users at startup (off by default so tests start fast)
+WARM_MODELS = os.getenv("SENTINELX_WARM_MODELS", "0") == "1"
+WARM_MODELS_ACTIVE_DAYS = 7
+
+def _recently_active_user_ids() -> List[int]:
+    db = SessionLocal()
+    try:
+        since = datetime.utcnow() - timedelta(days=WARM_MODELS_ACTIVE_DAYS)
+        return DatabaseOperations.get_recent_session_user_ids(db, since)
+    finally:
+        db.close()
+
+# Dedicated default executor for sklearn/joblib work, kept apart from the
+# AnyIO thread pool that serves sync dependencies such as get_db
+PREDICTION_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 2)
+
+async def warm_models():
+    """Load and warm recently active users' models so first predictions skip the cold path"""
+    loop = asyncio.get_running_loop()
+    user_ids = await loop.run_in_executor(None, _recently_active_user_ids)
+    results = await asyncio.gather(
+        *[loop.run_in_executor(None, predictor.warm_user_model, user_id) for user_id in user_ids]
+    )
+    print(f"✅ Warmed {sum(results)}/{len(user_ids)} user models")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting SENTINELX...")
+    prediction_executor = ThreadPoolExecutor(
+        max_workers=PREDICTION_MAX_WORKERS, thread_name_prefix="sentinelx-predict"
+    )
+    asyncio.get_running_loop().set_default_executor(prediction_executor)
     init_database()
     print("✅ Database initialized")
+    warm_prediction_kernels()
+    warm_trust_kernels()
+    if WARM_MODELS:
+        await warm_models()
+    activity_flush_task = asyncio.create_task(activity_flush_loop())
+    event_flush_task = asyncio.create_task(behavioral_event_flush_loop(open_behavioral_event_queue()))
     yield
     # Shutdown
     print("🛑 Shutting down SENTINELX...")
+    activity_flush_task.cancel()
+    event_flush_task.cancel()
+    await asyncio.gather(event_flush_task, return_exceptions=True)
+    flush_behavioral_events()
+    flush_activity_buffer()
+    prediction_executor.shutdown(wait=False)
 
 # Create FastAPI app
 app = FastAPI(
     title="SENTINELX API",
     description="Behavioral Biometric Authentication System",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Parse request bodies with orjson for every route declared on the app
+app.router.route_class = ORJSONRoute
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -82,33 +184,39 @@ app.include_router(auth_router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(keystroke_router, prefix="/api/behavior", tags=["Behavioral Data"])
 app.include_router(mouse_router, prefix="/api/behavior", tags=["Behavioral Data"])
 
+# Request models (validated in pydantic-core; unknown fields are ignored)
+class TrustScoreRequest(BaseModel):
+    sessionToken: str = Field(min_length=1)
+
+class SecurityActionRequest(BaseModel):
+    sessionId: int = Field(gt=0)
+    action: SecurityAction
+
+class ActivityUpdateRequest(BaseModel):
+    sessionToken: str = Field(min_length=1)
+
 # Trust Score Endpoints
 @app.post("/api/trust/score", tags=["Trust Engine"])
 async def calculate_trust_score(
-    request: dict,
+    request: TrustScoreRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Calculate trust score for current session"""
     try:
-        session_token = request.get("sessionToken")
-        if not session_token:
-            raise HTTPException(status_code=400, detail="Session token required")
+        session_token = request.sessionToken
         
-        # Get session from token
-        from backend.database.db import DatabaseOperations
-        session = DatabaseOperations.get_active_session(db, session_token)
-        if not session:
+        # Get session id from token (cached, no row attach)
+        session_id = DatabaseOperations.get_active_session_id(db, session_token)
+        if session_id is None:
             raise HTTPException(status_code=404, detail="Session not found")
         
         # Calculate trust score
-        trust_result = trust_engine.calculate_trust_score(session.id, db)
+        # Model scoring is CPU-bound; keep it off the event loop so WebSocket sends keep flowing
+        trust_result = await asyncio.to_thread(trust_engine.calculate_trust_score, session_id, db)
         
         # Send real-time update via WebSocket
-        await manager.send_personal_message({
-            "type": "trust_update",
-            "data": trust_result
-        }, session_token)
+        await manager.send_trust_update(trust_result, session_token)
         
         return trust_result
         
@@ -129,36 +237,41 @@ async def get_trust_history(
 # Security Action Endpoints
 @app.post("/api/security/action", tags=["Security"])
 async def execute_security_action(
-    request: dict,
+    request: SecurityActionRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Execute security action"""
     try:
-        session_id = request.get("sessionId")
-        action = request.get("action")
-        
-        if not session_id or not action:
-            raise HTTPException(status_code=400, detail="Session ID and action required")
-        
-        from backend.trust.trust_engine import SecurityAction
-        security_action = SecurityAction(action)
-        
-        result = trust_engine.execute_security_action(session_id, security_action, db)
+        result = await asyncio.to_thread(
+            trust_engine.execute_security_action, request.sessionId, request.action, db
+        )
         return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Read-mostly endpoints let dashboards revalidate instead of refetching
+STATUS_CACHE_MAX_AGE_SECONDS = 30
+
+def _etag_response(request: Request, body: bytes) -> Response:
+    """Serve a JSON body with an ETag and short max-age, answering 304 on a matching If-None-Match"""
+    etag = f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={STATUS_CACHE_MAX_AGE_SECONDS}"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # ML Model Endpoints
 @app.get("/api/ml/model/status/{user_id}", tags=["Machine Learning"])
 async def get_model_status(
     user_id: int,
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
     """Get ML model status for user"""
     status = predictor.get_model_status(user_id)
-    return status
+    return _etag_response(request, orjson.dumps(status))
 
 @app.post("/api/ml/model/train/{user_id}", tags=["Machine Learning"])
 async def train_user_model(
@@ -168,9 +281,8 @@ async def train_user_model(
 ):
     """Train ML model for specific user"""
     try:
-        from backend.ml.train_model import BehavioralAnomalyDetector
         detector = BehavioralAnomalyDetector()
-        result = detector.train_user_model(user_id, db)
+        result = await asyncio.to_thread(detector.train_user_model, user_id, db)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -183,7 +295,6 @@ async def get_session_info(
     current_user: User = Depends(get_current_user)
 ):
     """Get session information"""
-    from backend.database.models import UserSession
     session = db.query(UserSession).filter(UserSession.id == session_id).first()
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
@@ -199,23 +310,15 @@ async def get_session_info(
 
 @app.put("/api/session/activity", tags=["Session"])
 async def update_session_activity(
-    request: dict,
+    request: ActivityUpdateRequest,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """Update session activity timestamp"""
     try:
-        session_token = request.get("sessionToken")
-        if not session_token:
-            raise HTTPException(status_code=400, detail="Session token required")
-        
-        from backend.database.db import DatabaseOperations
-        from datetime import datetime
-        
-        session = DatabaseOperations.get_active_session(db, session_token)
-        if session:
-            session.last_activity = datetime.utcnow()
-            db.commit()
+        session_id = DatabaseOperations.get_active_session_id(db, request.sessionToken)
+        if session_id is not None:
+            record_session_activity(session_id)
             return {"status": "updated"}
         else:
             raise HTTPException(status_code=404, detail="Session not found")
@@ -224,17 +327,28 @@ async def update_session_activity(
         raise HTTPException(status_code=500, detail=str(e))
 
 # WebSocket endpoint for real-time updates
+# Development echo of client frames; off in production
+WS_ECHO = os.getenv("SENTINELX_DEBUG", "0") == "1"
+
 @app.websocket("/ws/{session_token}")
 async def websocket_endpoint(websocket: WebSocket, session_token: str):
     await manager.connect(websocket, session_token)
     try:
         while True:
-            # Keep connection alive and listen for messages
-            data = await websocket.receive_text()
-            # Echo back for testing
-            await websocket.send_text(f"Message received: {data}")
+            # Keep connection alive; raw frames are taken as-is (no text decode)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if WS_ECHO:
+                # Echo back for testing
+                data = message.get("text")
+                if data is None:
+                    data = (message.get("bytes") or b"").decode(errors="replace")
+                await websocket.send_text(f"Message received: {data}")
     except WebSocketDisconnect:
-        manager.disconnect(session_token)
+        pass
+    finally:
+        await manager.disconnect(session_token)
 
 # Health check endpoint
 @app.get("/api/health", tags=["System"])
@@ -247,16 +361,11 @@ async def health_check():
     }
 
 # Analytics endpoints
-@app.get("/api/analytics/behavioral/{user_id}", tags=["Analytics"])
-async def get_behavioral_analytics(
-    user_id: int,
-    range: str = "24h",
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user)
-):
-    """Get behavioral analytics for user"""
+@functools.lru_cache(maxsize=1024)
+def _behavioral_analytics_body(user_id: int, range: str) -> bytes:
+    """Encoded behavioral analytics payload (static until real analytics land)"""
     # Implementation for behavioral analytics
-    return {
+    return orjson.dumps({
         "user_id": user_id,
         "range": range,
         "keystroke_metrics": {
@@ -269,13 +378,26 @@ async def get_behavioral_analytics(
             "click_precision": 92,
             "movement_smoothness": 0.85
         }
-    }
+    })
+
+@app.get("/api/analytics/behavioral/{user_id}", tags=["Analytics"])
+async def get_behavioral_analytics(
+    user_id: int,
+    request: Request,
+    range: str = "24h",
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Get behavioral analytics for user"""
+    return _etag_response(request, _behavioral_analytics_body(user_id, range))
 
 @app.get("/api/analytics/system", tags=["Analytics"])
 async def get_system_metrics():
     """Get system-wide metrics"""
     return {
-        "active_sessions": len(manager.active_connections),
+        "active_sessions": manager.connection_count(),
+        **predictor.get_model_cache_stats(),
+        **get_event_write_stats(),
         "total_users": 0,  # Would query database
         "avg_trust_score": 0.85,
         "threat_level": "low"
@@ -1,17 +1,70 @@
 import numpy as np
 import joblib
+from cachetools import Cache, TTLCache
 from typing import Dict, List, Tuple, Optional
 from datetime import datetime
 import logging
+import os
+import threading
 from sqlalchemy.orm import Session
 from ..database.db import get_db
 from ..database.models import BehavioralEvent, UserSession
 from ..behavior.features import FeatureEngineer
+from ..utils.jit import njit, NUMBA_AVAILABLE
 import json
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Per-user ensembles kept resident: bounded in count and reloaded from disk hourly
+MODEL_CACHE_SIZE = int(os.getenv("SENTINELX_MODEL_CACHE", "512"))
+MODEL_CACHE_TTL_SECONDS = 3600
+
+class _ModelCache(TTLCache):
+    """TTLCache that counts entries dropped for size or age"""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+    
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+    
+    def expire(self, time=None):
+        # Cache.__len__ counts stored entries without triggering another expire()
+        before = Cache.__len__(self)
+        result = super().expire(time)
+        self.evictions += before - Cache.__len__(self)
+        return result
+
+# Number of most important features checked per prediction for explainability
+TOP_FEATURE_COUNT = 10
+
+# Per-prediction confidence kernel: compiled with Numba when available, NumPy otherwise
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _confidence_kernel(scores, preds):
+        """Blend model agreement and score consistency into a 0-1 confidence"""
+        agree = 0
+        for i in range(preds.size):
+            if preds[i] == preds[0]:
+                agree += 1
+        agreement_ratio = agree / preds.size
+        consistency = 1.0 / (1.0 + scores.var())
+        return min(1.0, max(0.0, agreement_ratio * 0.6 + consistency * 0.4))
+else:
+    def _confidence_kernel(scores, preds):
+        """Blend model agreement and score consistency into a 0-1 confidence"""
+        agreement_ratio = np.count_nonzero(preds == preds[0]) / preds.size
+        consistency = 1.0 / (1.0 + scores.var())
+        return min(1.0, max(0.0, agreement_ratio * 0.6 + consistency * 0.4))
+
+def warm_prediction_kernels():
+    """Compile (or load from cache) the JIT kernels before the first request"""
+    _confidence_kernel(np.zeros(2), np.ones(2, dtype=np.int64))
+
 class RealTimePredictor:
     """
     Real-time behavioral anomaly prediction system
@@ -19,7 +72,8 @@ class RealTimePredictor:
     """
     
     def __init__(self):
-        self.loaded_models = {}  # Cache for loaded user models
+        self.loaded_models = _ModelCache(maxsize=MODEL_CACHE_SIZE, ttl=MODEL_CACHE_TTL_SECONDS)  # Cache for loaded user models
+        self._models_lock = threading.Lock()
         self.feature_engineer = FeatureEngineer()
         
         # Anomaly thresholds
@@ -35,178 +89,235 @@ class RealTimePredictor:
             'one_class_svm': 0.3,
             'local_outlier_factor': 0.3
         }
+        
+        # Fixed model order for vectorized scoring. Each model's decision score maps to a 0-1
+        # anomaly probability as a * score + b clipped to [0, 1] (negative scores = anomalies):
+        #   isolation_forest:     (0.5 - score) / 1.0   (typical range -0.5 to 0.5)
+        #   one_class_svm:        (2 - score) / 4.0     (typical range -2 to 2)
+        #   local_outlier_factor: (-score - 1) / 2.0    (typical range -3 to -1)
+        self._model_order = ['isolation_forest', 'one_class_svm', 'local_outlier_factor']
+        self._norm_a = np.array([-1.0, -0.25, -0.5])
+        self._norm_b = np.array([0.5, 0.5, -0.5])
+        self._weight_vec = np.array([self.model_weights[m] for m in self._model_order])
     
     def load_user_model(self, user_id: int) -> bool:
         """Load trained model for a specific user"""
+        return self._get_user_models(user_id) is not None
+    
+    def _get_user_models(self, user_id: int) -> Optional[Dict]:
+        """Return the cached model entry for a user, loading it on a miss"""
         
-        if user_id in self.loaded_models:
-            return True
+        with self._models_lock:
+            user_models = self.loaded_models.get(user_id)
+        if user_models is not None:
+            return user_models
         
         try:
             model_filename = f"user_{user_id}_model.pkl"
-            model_data = joblib.load(model_filename)
+            # Memory-map the fitted arrays (support vectors, LOF training set, ...)
+            # read-only so the page cache is shared across workers
+            model_data = joblib.load(model_filename, mmap_mode='r')
+            
+            # Top features as parallel arrays, sorted by importance once per load
+            feature_importance = model_data['feature_importance']
+            names = np.array(list(feature_importance.keys()), dtype=object)
+            importances = np.fromiter(feature_importance.values(), dtype=np.float64,
+                                      count=len(feature_importance))
+            order = np.argsort(-importances, kind='stable')[:TOP_FEATURE_COUNT]
             
-            self.loaded_models[user_id] = {
+            # StandardScaler.transform as a fused float32 affine map (x - mean) * inv_scale
+            scaler = model_data['scaler']
+            scale_mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(scaler.n_features_in_)
+            scale = scaler.scale_ if scaler.scale_ is not None else np.ones(scaler.n_features_in_)
+            
+            user_models = {
                 'models': model_data['models'],
-                'scaler': model_data['scaler'],
+                'scaler': scaler,
+                'scale_mean': scale_mean.astype(np.float32),
+                'scale_inv': (1.0 / scale).astype(np.float32),
                 'feature_engineer': model_data['feature_engineer'],
                 'model_scores': model_data['model_scores'],
-                'feature_importance': model_data['feature_importance'],
+                'feature_importance': feature_importance,
+                'top_feature_names': names[order],
+                'top_feature_importances': importances[order],
                 'loaded_at': datetime.utcnow()
             }
+            # Status only changes when the entry is replaced, so build it once per load
+            user_models['status'] = {
+                "loaded": True,
+                "models_available": list(user_models['models'].keys()),
+                "loaded_at": user_models['loaded_at'].isoformat(),
+                "feature_count": len(feature_importance),
+                "top_features": list(feature_importance.keys())[:5]
+            }
+            with self._models_lock:
+                self.loaded_models[user_id] = user_models
             
             logger.info(f"Loaded model for user {user_id}")
-            return True
+            return user_models
             
         except FileNotFoundError:
             logger.warning(f"No trained model found for user {user_id}")
-            return False
+            return None
         except Exception as e:
             logger.error(f"Failed to load model for user {user_id}: {str(e)}")
+            return None
+    
+    def warm_user_model(self, user_id: int) -> bool:
+        """Load a user's model and score a zero vector to initialise sklearn's predict paths"""
+        
+        user_models = self._get_user_models(user_id)
+        if user_models is None:
             return False
+        
+        X_scaled = self._scale_features(user_models, np.zeros((1, len(user_models['scale_mean']))))
+        for model_name, model in user_models['models'].items():
+            try:
+                model.decision_function(X_scaled)
+            except Exception as e:
+                logger.warning(f"Warm-up of {model_name} failed for user {user_id}: {str(e)}")
+        return True
     
     def predict_anomaly(self, user_id: int, session_id: int, 
                        db: Session) -> Dict[str, any]:
         """Predict anomaly for current user session"""
         
         # Load user model if not already loaded
-        if not self.load_user_model(user_id):
-            return {
-                "anomaly_score": 0.0,
-                "risk_level": "unknown",
-                "confidence": 0.0,
-                "message": "No trained model available"
-            }
+        user_models = self._get_user_models(user_id)
+        if user_models is None:
+            return self._no_model_result()
         
         try:
             # Extract features for current session
             features = self.feature_engineer.extract_session_features(db, session_id)
             
             if not features:
-                return {
-                    "anomaly_score": 0.0,
-                    "risk_level": "insufficient_data",
-                    "confidence": 0.0,
-                    "message": "Insufficient behavioral data"
-                }
+                return self._insufficient_data_result()
             
-            # Convert to feature vector
+            # Convert to feature vector and scale
             feature_vector = self.feature_engineer.create_feature_vector(features)
+            X_scaled = self._scale_features(user_models, feature_vector.reshape(1, -1))
             
-            # Get user's trained models
-            user_models = self.loaded_models[user_id]
-            scaler = user_models['scaler']
-            models = user_models['models']
-            
-            # Scale features
-            X_scaled = scaler.transform(feature_vector.reshape(1, -1))
-            
-            # Get predictions from ensemble
-            ensemble_scores = {}
-            ensemble_predictions = {}
+            # Get decision scores from ensemble, one call per model
+            raw_scores, available = self._ensemble_decision_scores(user_models['models'], X_scaled)
+            if not available.any():
+                return self._all_models_failed_result()
             
-            for model_name, model in models.items():
-                try:
-                    if model_name == 'local_outlier_factor':
-                        # LOF returns negative outlier factor
-                        score = model.decision_function(X_scaled)[0]
-                        prediction = model.predict(X_scaled)[0]
-                    else:
-                        score = model.decision_function(X_scaled)[0]
-                        prediction = model.predict(X_scaled)[0]
-                    
-                    ensemble_scores[model_name] = score
-                    ensemble_predictions[model_name] = prediction
-                    
-                except Exception as e:
-                    logger.warning(f"Model {model_name} prediction failed: {str(e)}")
-                    continue
-            
-            if not ensemble_scores:
-                return {
-                    "anomaly_score": 0.0,
-                    "risk_level": "error",
-                    "confidence": 0.0,
-                    "message": "All models failed to predict"
-                }
-            
-            # Calculate weighted ensemble score
-            weighted_score = 0.0
-            total_weight = 0.0
-            
-            for model_name, score in ensemble_scores.items():
-                weight = self.model_weights.get(model_name, 0.33)
-                
-                # Normalize scores to 0-1 range (anomaly probability)
-                normalized_score = self._normalize_anomaly_score(score, model_name)
-                
-                weighted_score += normalized_score * weight
-                total_weight += weight
-            
-            if total_weight > 0:
-                final_anomaly_score = weighted_score / total_weight
-            else:
-                final_anomaly_score = 0.0
-            
-            # Determine risk level
-            risk_level = self._determine_risk_level(final_anomaly_score)
-            
-            # Calculate confidence based on model agreement
-            confidence = self._calculate_confidence(ensemble_scores, ensemble_predictions)
-            
-            # Feature analysis for explainability
-            feature_analysis = self._analyze_anomalous_features(
-                features, user_models['feature_importance']
+            anomaly_scores = self._weighted_anomaly_scores(raw_scores, available)
+            return self._build_prediction_result(
+                user_id, features, raw_scores[:, 0], available, anomaly_scores[0], user_models
             )
             
-            result = {
-                "anomaly_score": float(final_anomaly_score),
-                "risk_level": risk_level,
-                "confidence": float(confidence),
-                "model_scores": {k: float(v) for k, v in ensemble_scores.items()},
-                "feature_analysis": feature_analysis,
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            
-            # Log high-risk predictions
-            if risk_level in ['medium_risk', 'high_risk']:
-                logger.warning(f"Anomaly detected for user {user_id}: {risk_level} "
-                             f"(score: {final_anomaly_score:.3f})")
-            
-            return result
-            
         except Exception as e:
             logger.error(f"Prediction failed for user {user_id}: {str(e)}")
-            return {
-                "anomaly_score": 0.0,
-                "risk_level": "error",
-                "confidence": 0.0,
-                "message": f"Prediction error: {str(e)}"
-            }
+            return self._prediction_error_result(e)
     
-    def _normalize_anomaly_score(self, score: float, model_name: str) -> float:
-        """Normalize model-specific scores to 0-1 anomaly probability"""
+    @staticmethod
+    def _scale_features(user_models: Dict, X: np.ndarray) -> np.ndarray:
+        """Standardize feature rows with the user's precomputed scaler parameters"""
+        return (X.astype(np.float32, copy=False) - user_models['scale_mean']) * user_models['scale_inv']
+    
+    def _ensemble_decision_scores(self, models: Dict, X_scaled: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Decision scores of shape (n_available, n_samples) in model order, plus the availability mask"""
         
-        if model_name == 'isolation_forest':
-            # Isolation Forest: negative scores = anomalies
-            # Typical range: -0.5 to 0.5
-            normalized = max(0, (0.5 - score) / 1.0)
+        raw_scores = np.empty((len(self._model_order), X_scaled.shape[0]))
+        available = np.zeros(len(self._model_order), dtype=bool)
         
-        elif model_name == 'one_class_svm':
-            # One-Class SVM: negative scores = anomalies
-            # Typical range: -2 to 2
-            normalized = max(0, (2 - score) / 4.0)
+        for i, model_name in enumerate(self._model_order):
+            model = models.get(model_name)
+            if model is None:
+                continue
+            try:
+                raw_scores[i] = model.decision_function(X_scaled)
+                available[i] = True
+            except Exception as e:
+                logger.warning(f"Model {model_name} prediction failed: {str(e)}")
+                continue
         
-        elif model_name == 'local_outlier_factor':
-            # LOF: more negative = more anomalous
-            # Typical range: -3 to -1
-            normalized = max(0, min(1, (-score - 1) / 2.0))
+        return raw_scores[available], available
+    
+    def _weighted_anomaly_scores(self, raw_scores: np.ndarray, available: np.ndarray) -> np.ndarray:
+        """Normalize scores to 0-1 anomaly probability and take the weighted mean per sample"""
         
-        else:
-            # Default normalization
-            normalized = max(0, min(1, (1 - score) / 2.0))
+        weights = self._weight_vec[available]
+        normalized = np.clip(
+            self._norm_a[available, None] * raw_scores + self._norm_b[available, None], 0.0, 1.0
+        )
+        return (weights @ normalized) / weights.sum()
+    
+    def _build_prediction_result(self, user_id: int, features: Dict[str, float],
+                                 scores: np.ndarray, available: np.ndarray,
+                                 final_anomaly_score: float, user_models: Dict) -> Dict[str, any]:
+        """Assemble the prediction result for one sample from its per-model scores"""
+        
+        final_anomaly_score = float(final_anomaly_score)
         
-        return min(1.0, max(0.0, normalized))
+        # predict() is the sign of decision_function for all three models
+        model_names = [m for m, ok in zip(self._model_order, available) if ok]
+        ensemble_predictions = np.where(scores < 0, -1, 1).astype(np.int64)
+        
+        # Determine risk level
+        risk_level = self._determine_risk_level(final_anomaly_score)
+        
+        # Calculate confidence based on model agreement
+        confidence = self._calculate_confidence(scores, ensemble_predictions)
+        
+        # Feature analysis for explainability
+        feature_analysis = self._analyze_anomalous_features(
+            features, user_models['top_feature_names'], user_models['top_feature_importances']
+        )
+        
+        result = {
+            "anomaly_score": final_anomaly_score,
+            "risk_level": risk_level,
+            "confidence": float(confidence),
+            "model_scores": dict(zip(model_names, scores.tolist())),
+            "feature_analysis": feature_analysis,
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        
+        # Log high-risk predictions
+        if risk_level in ['medium_risk', 'high_risk']:
+            logger.warning(f"Anomaly detected for user {user_id}: {risk_level} "
+                         f"(score: {final_anomaly_score:.3f})")
+        
+        return result
+    
+    @staticmethod
+    def _no_model_result() -> Dict[str, any]:
+        return {
+            "anomaly_score": 0.0,
+            "risk_level": "unknown",
+            "confidence": 0.0,
+            "message": "No trained model available"
+        }
+    
+    @staticmethod
+    def _insufficient_data_result() -> Dict[str, any]:
+        return {
+            "anomaly_score": 0.0,
+            "risk_level": "insufficient_data",
+            "confidence": 0.0,
+            "message": "Insufficient behavioral data"
+        }
+    
+    @staticmethod
+    def _all_models_failed_result() -> Dict[str, any]:
+        return {
+            "anomaly_score": 0.0,
+            "risk_level": "error",
+            "confidence": 0.0,
+            "message": "All models failed to predict"
+        }
+    
+    @staticmethod
+    def _prediction_error_result(error: Exception) -> Dict[str, any]:
+        return {
+            "anomaly_score": 0.0,
+            "risk_level": "error",
+            "confidence": 0.0,
+            "message": f"Prediction error: {str(error)}"
+        }
     
     def _determine_risk_level(self, anomaly_score: float) -> str:
         """Determine risk level based on anomaly score"""
@@ -220,62 +331,81 @@ class RealTimePredictor:
         else:
             return 'normal'
     
-    def _calculate_confidence(self, scores: Dict[str, float], 
-                            predictions: Dict[str, int]) -> float:
+    def _calculate_confidence(self, scores: np.ndarray, 
+                            predictions: np.ndarray) -> float:
         """Calculate prediction confidence based on model agreement"""
         
-        if len(scores) < 2:
+        if scores.size < 2:
             return 0.5  # Low confidence with single model
         
-        # Check prediction agreement
-        pred_values = list(predictions.values())
-        agreement_ratio = pred_values.count(pred_values[0]) / len(pred_values)
-        
-        # Check score consistency (lower variance = higher confidence)
-        score_values = list(scores.values())
-        score_variance = np.var(score_values)
-        consistency = 1.0 / (1.0 + score_variance)
-        
-        # Combine agreement and consistency
-        confidence = (agreement_ratio * 0.6) + (consistency * 0.4)
-        
-        return min(1.0, max(0.0, confidence))
+        # Agreement of predictions combined with score consistency (lower variance = higher confidence)
+        return float(_confidence_kernel(scores, predictions))
     
     def _analyze_anomalous_features(self, current_features: Dict[str, float],
-                                  feature_importance: Dict[str, float]) -> Dict[str, any]:
+                                  top_names: np.ndarray,
+                                  top_importances: np.ndarray) -> Dict[str, any]:
         """Analyze which features contribute most to anomaly detection"""
         
-        # Get top important features
-        top_features = dict(list(feature_importance.items())[:10])
+        # Values of the top important features (absent features can't be anomalous)
+        values = np.fromiter((current_features.get(name, 0.0) for name in top_names),
+                             dtype=np.float64, count=len(top_names))
         
-        anomalous_features = []
-        for feature_name, importance in top_features.items():
-            if feature_name in current_features:
-                value = current_features[feature_name]
-                
-                # Simple anomaly detection for individual features
-                # In practice, this would use learned thresholds
-                if abs(value) > 2.0:  # Simple z-score threshold
-                    anomalous_features.append({
-                        "feature": feature_name,
-                        "value": float(value),
-                        "importance": float(importance),
-                        "anomaly_type": "extreme_value"
-                    })
+        # Simple anomaly detection for individual features
+        # In practice, this would use learned thresholds
+        extreme = np.flatnonzero(np.abs(values) > 2.0)  # Simple z-score threshold
+        
+        anomalous_features = [{
+            "feature": top_names[i],
+            "value": float(values[i]),
+            "importance": float(top_importances[i]),
+            "anomaly_type": "extreme_value"
+        } for i in extreme]
         
         return {
             "anomalous_features": anomalous_features,
             "total_features_analyzed": len(current_features),
-            "top_important_features": list(top_features.keys())[:5]
+            "top_important_features": top_names[:5].tolist()
         }
     
     def batch_predict(self, user_id: int, session_ids: List[int], 
                      db: Session) -> List[Dict[str, any]]:
-        """Predict anomalies for multiple sessions"""
+        """Predict anomalies for multiple sessions with one scoring pass per model"""
+        
+        user_models = self._get_user_models(user_id)
+        if user_models is None:
+            return [{**self._no_model_result(), 'session_id': sid} for sid in session_ids]
+        
+        try:
+            # One batched extraction, then a single (N, d) matrix through each model
+            features_by_session = self.feature_engineer.extract_session_features_batch(db, session_ids)
+            scored_ids = [sid for sid in dict.fromkeys(session_ids) if features_by_session.get(sid)]
+            
+            results_by_session = {}
+            if scored_ids:
+                X = np.stack([
+                    self.feature_engineer.create_feature_vector(features_by_session[sid])
+                    for sid in scored_ids
+                ])
+                X_scaled = self._scale_features(user_models, X)
+                
+                raw_scores, available = self._ensemble_decision_scores(user_models['models'], X_scaled)
+                if not available.any():
+                    return [{**self._all_models_failed_result(), 'session_id': sid} for sid in session_ids]
+                
+                anomaly_scores = self._weighted_anomaly_scores(raw_scores, available)
+                for j, sid in enumerate(scored_ids):
+                    results_by_session[sid] = self._build_prediction_result(
+                        user_id, features_by_session[sid], raw_scores[:, j], available,
+                        anomaly_scores[j], user_models
+                    )
+            
+        except Exception as e:
+            logger.error(f"Batch prediction failed for user {user_id}: {str(e)}")
+            return [{**self._prediction_error_result(e), 'session_id': sid} for sid in session_ids]
         
         results = []
         for session_id in session_ids:
-            result = self.predict_anomaly(user_id, session_id, db)
+            result = dict(results_by_session.get(session_id) or self._insufficient_data_result())
             result['session_id'] = session_id
             results.append(result)
         
@@ -284,32 +414,35 @@ class RealTimePredictor:
     def get_model_status(self, user_id: int) -> Dict[str, any]:
         """Get status of loaded model for user"""
         
-        if user_id not in self.loaded_models:
+        with self._models_lock:
+            model_info = self.loaded_models.get(user_id)
+        
+        if model_info is None:
             return {
                 "loaded": False,
                 "message": "Model not loaded"
             }
         
-        model_info = self.loaded_models[user_id]
-        
-        return {
-            "loaded": True,
-            "models_available": list(model_info['models'].keys()),
-            "loaded_at": model_info['loaded_at'].isoformat(),
-            "feature_count": len(model_info['feature_importance']),
-            "top_features": list(model_info['feature_importance'].keys())[:5]
-        }
+        return dict(model_info['status'])
+    
+    def get_model_cache_stats(self) -> Dict[str, int]:
+        """Resident model count and evictions since startup"""
+        with self._models_lock:
+            return {
+                "loaded_models": len(self.loaded_models),
+                "model_cache_evictions": self.loaded_models.evictions
+            }
     
     def clear_model_cache(self, user_id: Optional[int] = None):
         """Clear model cache for specific user or all users"""
         
-        if user_id:
-            if user_id in self.loaded_models:
-                del self.loaded_models[user_id]
-                logger.info(f"Cleared model cache for user {user_id}")
-        else:
-            self.loaded_models.clear()
-            logger.info("Cleared all model caches")
+        with self._models_lock:
+            if user_id:
+                if self.loaded_models.pop(user_id, None) is not None:
+                    logger.info(f"Cleared model cache for user {user_id}")
+            else:
+                self.loaded_models.clear()
+                logger.info("Cleared all model caches")
 
 # Global predictor instance
 predictor = RealTimePredictor()
\ No newline at end of file
@@ -7,45 +7,124 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, confusion_matrix
 import joblib
-import json
-from typing import Dict, List, Tuple, Any
+from joblib import Parallel, delayed, parallel_backend
+import orjson
+import os
+from typing import Dict, List, Optional, Tuple, Any
 from datetime import datetime, timedelta
+from sqlalchemy import func, insert, select, update
 from sqlalchemy.orm import Session
 from ..database.db import get_db, SessionLocal
-from ..database.models import User, BehavioralEvent, BehavioralProfile
+from ..database.models import User, UserSession, BehavioralEvent, BehavioralProfile
 from ..behavior.features import FeatureEngineer
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Worker processes for batch training (-1 = one per core)
+TRAINING_N_JOBS = -1
+
+# Rows subsampled per isolation tree (the paper's psi); fit cost stops growing with N past this
+ISOLATION_FOREST_MAX_SAMPLES = 256
+
+# Training rows scored for the logged model_scores (sampled estimate above this)
+MODEL_SCORE_SAMPLE_SIZE = 1000
+
+# Sessions sampled per user to fit the batch-wide feature scalers
+SCALER_SAMPLE_SESSIONS_PER_USER = 200
+
+# libsvm kernel cache bounds (MB); the default 200 thrashes once the N x N matrix outgrows it
+OCSVM_MIN_CACHE_MB = 200
+OCSVM_MAX_CACHE_MB = 2000
+
+# Opt-in model file compression. Off by default: the predictor memory-maps model
+# files, which joblib can only do for uncompressed pickles
+COMPRESS_MODELS = os.getenv("SENTINELX_COMPRESS_MODELS", "0") == "1"
+try:
+    import lz4  # noqa: F401  (joblib's fastest codec, used when installed)
+    MODEL_COMPRESSION = ('lz4', 3)
+except ImportError:
+    MODEL_COMPRESSION = ('zlib', 3)
+
+class PrecomputedRBFOneClassSVM:
+    """
+    One-Class SVM over an RBF Gram matrix built with one BLAS GEMM
+    Fits libsvm on kernel='precomputed' and keeps only the support vectors,
+    so scoring new points is a GEMM against them plus the dual coefficients
+    """
+    
+    def __init__(self, nu: float = 0.1, cache_size: float = 200):
+        self.nu = nu
+        self.cache_size = cache_size
+    
+    @staticmethod
+    def _rbf_kernel(A: np.ndarray, B: np.ndarray, gamma: float) -> np.ndarray:
+        """exp(-gamma * ||a - b||^2) via ||a||^2 + ||b||^2 - 2 a.b (the a.b term is a GEMM)"""
+        sq_dist = (A * A).sum(axis=1)[:, None] + (B * B).sum(axis=1)[None, :] - 2.0 * (A @ B.T)
+        np.maximum(sq_dist, 0.0, out=sq_dist)  # Clamp rounding below zero
+        sq_dist *= -gamma
+        return np.exp(sq_dist, out=sq_dist)
+    
+    def fit(self, X: np.ndarray) -> 'PrecomputedRBFOneClassSVM':
+        X = np.asarray(X, dtype=np.float64)
+        
+        # Same rule as sklearn's gamma='scale'
+        X_var = X.var()
+        self.gamma_ = 1.0 / (X.shape[1] * X_var) if X_var != 0 else 1.0
+        
+        K = self._rbf_kernel(X, X, self.gamma_)
+        self.svm_ = OneClassSVM(kernel='precomputed', nu=self.nu, cache_size=self.cache_size).fit(K)
+        
+        self.support_vectors_ = X[self.svm_.support_]
+        self.dual_coef_ = self.svm_.dual_coef_.ravel()
+        self.intercept_ = float(self.svm_.intercept_[0])
+        return self
+    
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        K = self._rbf_kernel(np.asarray(X, dtype=np.float64), self.support_vectors_, self.gamma_)
+        return K @ self.dual_coef_ + self.intercept_
+    
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        # libsvm labels a point an inlier only for a strictly positive decision value
+        return np.where(self.decision_function(X) > 0, 1, -1)
+
 class BehavioralAnomalyDetector:
     """
     Advanced ML pipeline for behavioral biometric anomaly detection
     Uses ensemble of algorithms for robust authentication
     """
     
-    def __init__(self):
+    def __init__(self, n_jobs: int = -1, feature_engineer: FeatureEngineer = None):
+        # Cores for tree building/scoring; 1 inside batch-training workers to avoid oversubscription
+        self.n_jobs = n_jobs
+        
         # Ensemble of anomaly detection models
         self.models = {
             'isolation_forest': IsolationForest(
                 contamination=0.1,
                 random_state=42,
-                n_estimators=100
+                n_estimators=100,
+                n_jobs=n_jobs
             ),
-            'one_class_svm': OneClassSVM(
-                kernel='rbf',
-                gamma='scale',
+            'one_class_svm': PrecomputedRBFOneClassSVM(
                 nu=0.1
             ),
             'local_outlier_factor': LocalOutlierFactor(
                 n_neighbors=20,
                 contamination=0.1,
-                novelty=True
+                novelty=True,
+                # Tree search beats brute-force O(N^2) at our ~tens of feature dims
+                algorithm='ball_tree',
+                leaf_size=40,
+                n_jobs=n_jobs
             )
         }
         
-        self.feature_engineer = FeatureEngineer()
+        # A pre-fitted engineer shared across a training batch is used as-is, not refit per user
+        self.feature_engineer = feature_engineer if feature_engineer is not None else FeatureEngineer()
+        self.refit_feature_scalers = feature_engineer is None
+        self._feature_names = self.feature_engineer._get_expected_feature_names()
         self.scaler = StandardScaler()
         self.is_trained = False
         self.feature_importance = {}
@@ -64,45 +143,47 @@ class BehavioralAnomalyDetector:
         # Get user's behavioral events from the last N days
         cutoff_date = datetime.utcnow() - timedelta(days=days_back)
         
-        events = db.query(BehavioralEvent).join(
-            BehavioralEvent.session
-        ).filter(
-            BehavioralEvent.session.has(user_id=user_id),
-            BehavioralEvent.timestamp >= cutoff_date
-        ).order_by(BehavioralEvent.timestamp).all()
+        # Only the session id per event is needed here: stream the scalar column straight into NumPy
+        session_ids = np.fromiter(db.execute(
+            select(BehavioralEvent.session_id).join(
+                UserSession, BehavioralEvent.session_id == UserSession.id
+            ).where(
+                UserSession.user_id == user_id,
+                BehavioralEvent.timestamp >= cutoff_date
+            ).order_by(BehavioralEvent.timestamp)
+        ).scalars(), dtype=np.int64)
         
-        if len(events) < 50:  # Need minimum samples for training
-            logger.warning(f"Insufficient training data for user {user_id}: {len(events)} events")
+        if len(session_ids) < 50:  # Need minimum samples for training
+            logger.warning(f"Insufficient training data for user {user_id}: {len(session_ids)} events")
             return np.array([]), []
         
-        # Group events by session for feature extraction
-        session_groups = {}
-        for event in events:
-            session_id = event.session_id
-            if session_id not in session_groups:
-                session_groups[session_id] = []
-            session_groups[session_id].append(event)
+        # Count events per session, kept in first-seen order (as the sessions occurred)
+        unique_ids, first_seen, counts = np.unique(session_ids, return_index=True, return_counts=True)
+        order = np.argsort(first_seen)
+        kept_sessions = unique_ids[order][counts[order] >= 10]  # Minimum events per session
         
-        # Extract features for each session
-        feature_vectors = []
+        # Extract features for all kept sessions with one batched event query
+        session_features = self.feature_engineer.extract_session_features_batch(db, kept_sessions.tolist())
+        
+        # Rows are written straight into one preallocated float32 matrix (halves the bytes
+        # every estimator scans, LOF's stored _fit_X included)
+        X = np.empty((len(session_features), len(self._feature_names)), dtype=np.float32)
         feature_dicts = []
         
-        for session_id, session_events in session_groups.items():
-            if len(session_events) >= 10:  # Minimum events per session
-                features = self.feature_engineer.extract_session_features(db, session_id)
-                if features:
-                    feature_vector = self.feature_engineer.create_feature_vector(features)
-                    feature_vectors.append(feature_vector)
-                    feature_dicts.append(features)
+        for features in session_features.values():
+            if features:
+                X[len(feature_dicts)] = self.feature_engineer.create_feature_vector(features)
+                feature_dicts.append(features)
         
-        if len(feature_vectors) < 10:
-            logger.warning(f"Insufficient feature vectors for user {user_id}: {len(feature_vectors)}")
+        if len(feature_dicts) < 10:
+            logger.warning(f"Insufficient feature vectors for user {user_id}: {len(feature_dicts)}")
             return np.array([]), []
         
-        return np.array(feature_vectors), feature_dicts
+        return X[:len(feature_dicts)], feature_dicts
     
-    def train_user_model(self, user_id: int, db: Session = None) -> Dict[str, Any]:
-        """Train anomaly detection model for a specific user"""
+    def train_user_model(self, user_id: int, db: Session = None,
+                         save_profile: bool = True) -> Dict[str, Any]:
+        """Train anomaly detection model for a specific user (profile row returned, not saved, if save_profile=False)"""
         
         if db is None:
             db = SessionLocal()
@@ -120,12 +201,25 @@ class BehavioralAnomalyDetector:
                     "samples_collected": 0
                 }
             
-            # Fit feature scalers
-            self.feature_engineer.fit_scalers([X_train])
+            # Fit feature scalers (unless shared across the batch)
+            if self.refit_feature_scalers:
+                self.feature_engineer.fit_scalers([X_train])
             
-            # Transform features
+            # Transform features (the per-user scaler keeps each model relative to the user's own baseline)
             X_scaled = self.scaler.fit_transform(X_train)
             
+            # Explicit per-tree subsample, capped at N so small users don't trigger sklearn's warning
+            self.models['isolation_forest'].set_params(
+                max_samples=min(ISOLATION_FOREST_MAX_SAMPLES, len(X_scaled))
+            )
+            
+            # Size the OCSVM kernel cache to hold every row of the N x N matrix
+            self.models['one_class_svm'].cache_size = self._ocsvm_cache_size(len(X_scaled))
+            
+            # model_scores are summary stats, so large users are evaluated on a fixed random subsample
+            eval_idx = self._model_score_sample(len(X_scaled))
+            X_eval = X_scaled[eval_idx]
+            
             # Train ensemble models
             trained_models = {}
             model_scores = {}
@@ -140,13 +234,16 @@ class BehavioralAnomalyDetector:
                     else:
                         model.fit(X_scaled)
                     
-                    # Evaluate model on training data
-                    if model_name != 'local_outlier_factor':
-                        predictions = model.predict(X_scaled)
-                        anomaly_scores = model.decision_function(X_scaled)
-                    else:
-                        predictions = model.predict(X_scaled)
-                        anomaly_scores = model.negative_outlier_factor_
+                    # Evaluate model on training data (IsolationForest scores its trees
+                    # sequentially unless a joblib backend is active; it requires shared memory)
+                    with parallel_backend('threading', n_jobs=self.n_jobs):
+                        if model_name != 'local_outlier_factor':
+                            # predict() would recompute the decision scores; it flags outliers below 0
+                            anomaly_scores = model.decision_function(X_eval)
+                            predictions = np.where(anomaly_scores < 0, -1, 1)
+                        else:
+                            predictions = model.predict(X_eval)
+                            anomaly_scores = model.negative_outlier_factor_[eval_idx]
                     
                     # Calculate model performance metrics
                     normal_ratio = np.sum(predictions == 1) / len(predictions)
@@ -188,14 +285,17 @@ class BehavioralAnomalyDetector:
             
             # Save to file
             model_filename = f"user_{user_id}_model.pkl"
-            joblib.dump(model_data, model_filename)
+            joblib.dump(model_data, model_filename,
+                        compress=MODEL_COMPRESSION if COMPRESS_MODELS else 0, protocol=5)
             
             # Update user's behavioral profile
-            self._update_behavioral_profile(db, user_id, feature_dicts, model_scores)
+            profile_row = self._build_profile_row(user_id, feature_dicts)
+            if save_profile:
+                self._save_behavioral_profiles(db, [profile_row])
             
             self.is_trained = True
             
-            return {
+            result = {
                 "success": True,
                 "message": "Model trained successfully",
                 "samples_collected": len(X_train),
@@ -203,6 +303,9 @@ class BehavioralAnomalyDetector:
                 "model_file": model_filename,
                 "feature_importance": dict(list(self.feature_importance.items())[:10])  # Top 10
             }
+            if not save_profile:
+                result["profile"] = profile_row
+            return result
             
         except Exception as e:
             logger.error(f"Training failed for user {user_id}: {str(e)}")
@@ -214,6 +317,46 @@ class BehavioralAnomalyDetector:
         finally:
             db.close()
     
+    @staticmethod
+    def _model_score_sample(n_samples: int) -> np.ndarray:
+        """Row indices used for model_scores: all rows, or a seeded subsample of large sets"""
+        if n_samples <= MODEL_SCORE_SAMPLE_SIZE:
+            return np.arange(n_samples)
+        return np.sort(np.random.default_rng(42).choice(n_samples, size=MODEL_SCORE_SAMPLE_SIZE, replace=False))
+    
+    @staticmethod
+    def _ocsvm_cache_size(n_samples: int) -> int:
+        """libsvm cache (MB) for a full float64 kernel matrix, clamped to sane bounds"""
+        cache_mb = int(8 * n_samples * n_samples / (1024 * 1024)) + 128
+        return max(OCSVM_MIN_CACHE_MB, min(cache_mb, OCSVM_MAX_CACHE_MB))
+    
+    def _fit_shared_feature_engineer(self, db: Session) -> Optional[FeatureEngineer]:
+        """Fit one FeatureEngineer on a per-user random sample of sessions for a whole batch"""
+        
+        # Up to SCALER_SAMPLE_SESSIONS_PER_USER random sessions from every user, in one query
+        ranked = db.query(
+            UserSession.id.label('session_id'),
+            func.row_number().over(
+                partition_by=UserSession.user_id, order_by=func.random()
+            ).label('sample_rank')
+        ).subquery()
+        session_ids = [
+            session_id for (session_id,) in
+            db.query(ranked.c.session_id).filter(ranked.c.sample_rank <= SCALER_SAMPLE_SESSIONS_PER_USER)
+        ]
+        
+        feature_engineer = FeatureEngineer()
+        X_global = [
+            feature_engineer.create_feature_vector(features)
+            for features in feature_engineer.extract_session_features_batch(db, session_ids).values()
+            if features
+        ]
+        if len(X_global) < 2:
+            return None
+        
+        feature_engineer.fit_scalers(X_global)
+        return feature_engineer
+    
     def _calculate_feature_importance(self, X: np.ndarray, 
                                     feature_dicts: List[Dict]) -> Dict[str, float]:
         """Calculate feature importance using variance and correlation analysis"""
@@ -221,122 +364,151 @@ class BehavioralAnomalyDetector:
         if len(X) == 0:
             return {}
         
-        feature_names = self.feature_engineer._get_expected_feature_names()
-        importance_scores = {}
+        feature_names = self._feature_names
+        
+        # Calculate variance-based importance (float32 like the training matrix, no upcast copy)
+        normalized_variances = X.var(axis=0, dtype=np.float32)
         
-        # Calculate variance-based importance
-        feature_variances = np.var(X, axis=0)
+        # Normalize variances in place (one max scan)
+        max_variance = normalized_variances.max()
+        if max_variance > 0:
+            normalized_variances /= max_variance
         
-        # Normalize variances
-        max_variance = np.max(feature_variances) if np.max(feature_variances) > 0 else 1
-        normalized_variances = feature_variances / max_variance
+        # Sort by importance (stable descending, so ties keep feature order)
+        n_named = min(len(feature_names), len(normalized_variances))
+        order = np.argsort(-normalized_variances[:n_named], kind='stable')
         
-        for i, feature_name in enumerate(feature_names[:len(normalized_variances)]):
-            importance_scores[feature_name] = float(normalized_variances[i])
+        return {feature_names[i]: float(normalized_variances[i]) for i in order.tolist()}
+    
+    def _build_profile_row(self, user_id: int, feature_dicts: List[Dict]) -> Dict[str, Any]:
+        """Behavioral profile column values for a user; empty patterns are left out"""
+        
+        # Calculate profile statistics column-wise (features missing from a session are skipped)
+        features_df = pd.DataFrame(feature_dicts)
+        mean_vals = features_df.mean(numeric_only=True).add_suffix('_mean')
+        std_vals = features_df.std(numeric_only=True, ddof=0).add_suffix('_std')
+        profile_stats = pd.concat([mean_vals, std_vals]).to_dict()
+        
+        profile_row = {
+            'user_id': user_id,
+            'samples_count': len(feature_dicts),
+            'confidence_score': min(len(feature_dicts) / 100.0, 1.0),  # Max confidence at 100 samples
+            'last_updated': datetime.utcnow()
+        }
         
-        # Sort by importance
-        sorted_importance = dict(sorted(importance_scores.items(), 
-                                      key=lambda x: x[1], reverse=True))
+        # Keystroke and mouse patterns (orjson encodes NumPy scalars natively)
+        keystroke_features = {k: v for k, v in profile_stats.items() if k.startswith('ks_')}
+        mouse_features = {k: v for k, v in profile_stats.items() if k.startswith('ms_')}
+        if keystroke_features:
+            profile_row['typing_rhythm_pattern'] = orjson.dumps(
+                keystroke_features, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+        if mouse_features:
+            profile_row['mouse_movement_pattern'] = orjson.dumps(
+                mouse_features, option=orjson.OPT_SERIALIZE_NUMPY).decode()
         
-        return sorted_importance
+        return profile_row
     
-    def _update_behavioral_profile(self, db: Session, user_id: int, 
-                                 feature_dicts: List[Dict], model_scores: Dict):
-        """Update user's behavioral profile in database"""
-        
-        # Calculate aggregate statistics
-        all_features = {}
-        for feature_dict in feature_dicts:
-            for key, value in feature_dict.items():
-                if key not in all_features:
-                    all_features[key] = []
-                all_features[key].append(value)
-        
-        # Calculate profile statistics
-        profile_stats = {}
-        for feature, values in all_features.items():
-            profile_stats[f"{feature}_mean"] = np.mean(values)
-            profile_stats[f"{feature}_std"] = np.std(values)
-        
-        # Check if profile exists
-        profile = db.query(BehavioralProfile).filter(
-            BehavioralProfile.user_id == user_id
-        ).first()
-        
-        if profile:
-            # Update existing profile
-            profile.samples_count = len(feature_dicts)
-            profile.confidence_score = min(len(feature_dicts) / 100.0, 1.0)  # Max confidence at 100 samples
-            profile.last_updated = datetime.utcnow()
-            
-            # Update keystroke and mouse patterns
-            keystroke_features = {k: v for k, v in profile_stats.items() if k.startswith('ks_')}
-            mouse_features = {k: v for k, v in profile_stats.items() if k.startswith('ms_')}
-            
-            if keystroke_features:
-                profile.typing_rhythm_pattern = json.dumps(keystroke_features)
-            if mouse_features:
-                profile.mouse_movement_pattern = json.dumps(mouse_features)
-        else:
-            # Create new profile
-            profile = BehavioralProfile(
-                user_id=user_id,
-                samples_count=len(feature_dicts),
-                confidence_score=min(len(feature_dicts) / 100.0, 1.0),
-                typing_rhythm_pattern=json.dumps({k: v for k, v in profile_stats.items() if k.startswith('ks_')}),
-                mouse_movement_pattern=json.dumps({k: v for k, v in profile_stats.items() if k.startswith('ms_')}),
-                last_updated=datetime.utcnow()
-            )
-            db.add(profile)
+    def _save_behavioral_profiles(self, db: Session, profile_rows: List[Dict[str, Any]]):
+        """Write profile rows in one transaction: bulk UPDATE existing profiles, bulk INSERT new ones"""
+        
+        if not profile_rows:
+            return
         
+        # First profile per user, as the per-user query(...).first() used to pick
+        existing = {}
+        for profile_id, user_id in db.query(BehavioralProfile.id, BehavioralProfile.user_id).filter(
+            BehavioralProfile.user_id.in_([row['user_id'] for row in profile_rows])
+        ).order_by(BehavioralProfile.id):
+            existing.setdefault(user_id, profile_id)
+        
+        # Existing profiles keep their old pattern when a user had none this time;
+        # new profiles store an empty pattern instead
+        updates = [{'id': existing[row['user_id']], **row} for row in profile_rows if row['user_id'] in existing]
+        inserts = [
+            {'typing_rhythm_pattern': '{}', 'mouse_movement_pattern': '{}', **row}
+            for row in profile_rows if row['user_id'] not in existing
+        ]
+        
+        if updates:
+            db.execute(update(BehavioralProfile), updates)
+        if inserts:
+            db.execute(insert(BehavioralProfile), inserts)
         db.commit()
-        logger.info(f"Updated behavioral profile for user {user_id}")
+        logger.info(f"Updated behavioral profiles for {len(profile_rows)} user(s)")
     
     def train_all_users(self, db: Session = None) -> Dict[str, Any]:
-        """Train models for all users with sufficient data"""
+        """Train models for all users with sufficient data, one worker process per core"""
         
         if db is None:
             db = SessionLocal()
         
         try:
-            # Get all users
-            users = db.query(User).all()
+            # Get all users (plain rows, so nothing depends on the session after close)
+            users = db.query(User.id, User.username).all()
             
-            results = {
-                "total_users": len(users),
-                "trained_successfully": 0,
-                "training_failed": 0,
-                "insufficient_data": 0,
-                "details": []
+            # Feature scalers are fit once for the batch rather than once per user
+            feature_engineer = self._fit_shared_feature_engineer(db)
+        except Exception as e:
+            logger.error(f"Batch training failed: {str(e)}")
+            return {
+                "success": False,
+                "message": f"Batch training failed: {str(e)}"
             }
-            
-            for user in users:
-                logger.info(f"Processing user {user.id}: {user.username}")
-                
-                result = self.train_user_model(user.id, db)
-                results["details"].append({
-                    "user_id": user.id,
-                    "username": user.username,
-                    "result": result
-                })
-                
-                if result["success"]:
-                    results["trained_successfully"] += 1
-                elif result["samples_collected"] == 0:
-                    results["insufficient_data"] += 1
-                else:
-                    results["training_failed"] += 1
-            
-            return results
-            
+        finally:
+            db.close()
+        
+        try:
+            # Users are independent: each worker trains with its own detector and DB session
+            user_results = Parallel(n_jobs=TRAINING_N_JOBS, backend='loky', batch_size=1)(
+                delayed(_train_one)(user.id, feature_engineer) for user in users
+            )
         except Exception as e:
             logger.error(f"Batch training failed: {str(e)}")
             return {
                 "success": False,
                 "message": f"Batch training failed: {str(e)}"
             }
+        
+        # Profiles from every worker are written together, committed once
+        profile_rows = [result.pop("profile") for result in user_results if "profile" in result]
+        db = SessionLocal()
+        try:
+            self._save_behavioral_profiles(db, profile_rows)
+        except Exception as e:
+            logger.error(f"Saving behavioral profiles failed: {str(e)}")
         finally:
             db.close()
+        
+        results = {
+            "total_users": len(users),
+            "trained_successfully": 0,
+            "training_failed": 0,
+            "insufficient_data": 0,
+            "details": []
+        }
+        
+        for user, result in zip(users, user_results):
+            results["details"].append({
+                "user_id": user.id,
+                "username": user.username,
+                "result": result
+            })
+            
+            if result["success"]:
+                results["trained_successfully"] += 1
+            elif result["samples_collected"] == 0:
+                results["insufficient_data"] += 1
+            else:
+                results["training_failed"] += 1
+        
+        return results
+
+def _train_one(user_id: int, feature_engineer: Optional[FeatureEngineer] = None) -> Dict[str, Any]:
+    """Train one user in a worker with a fresh detector and its own DB session"""
+    logger.info(f"Processing user {user_id}")
+    # Parallelism is across users here, so each worker's estimators stay single-threaded
+    detector = BehavioralAnomalyDetector(n_jobs=1, feature_engineer=feature_engineer)
+    return detector.train_user_model(user_id, save_profile=False)
 
 def main():
     """Main training function"""
@@ -1,12 +1,17 @@
 import numpy as np
-from typing import Dict, List, Tuple, Optional, Any
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Tuple, Optional, Any
 from datetime import datetime, timedelta
 from enum import Enum
 import logging
+import threading
+from cachetools import TTLCache
+from sqlalchemy import DateTime, Float, Integer, String, bindparam, func, select, text, update
 from sqlalchemy.orm import Session
-from backend.database.db import get_db, DatabaseOperations
-from backend.database.models import UserSession, BehavioralEvent
-from backend.ml.predict import RealTimePredictor
+from backend.database.db import get_db, DatabaseOperations, invalidate_active_session
+from backend.database.models import BehavioralEvent, UserSession
+from backend.ml.predict import predictor
+from backend.utils.jit import njit, NUMBA_AVAILABLE
 import json
 
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +34,105 @@ class SecurityAction(Enum):
     LOG_ONLY = "log_only"
     NO_ACTION = "no_action"
 
+# Windows read by the trust components
+TEMPORAL_WINDOW = timedelta(minutes=10)
+TEMPORAL_EVENT_LIMIT = 20
+ANOMALY_WINDOW = timedelta(minutes=15)
+HISTORY_WINDOW = timedelta(days=7)
+HISTORY_SESSION_LIMIT = 10
+
+# Trust levels whose evaluations are logged as warnings
+_LOW_TRUST_LEVELS = frozenset((TrustLevel.CRITICAL.value, TrustLevel.LOW.value))
+
+# Recent trust results keyed by (session id, latest event id, include_session_info): repeat
+# polls with no new events inside the TTL skip prediction and every trust query
+TRUST_CACHE_SIZE = 10_000
+TRUST_CACHE_TTL_SECONDS = 1
+
+# Newest behavioral event of the session row it is selected alongside
+_latest_event_id = select(func.max(BehavioralEvent.id)).where(
+    BehavioralEvent.session_id == UserSession.id
+).scalar_subquery()
+
+# Every event/history input of the trust components as one row set tagged by kind: recent
+# timestamps, historical trust scores, and a single row of the session's event counts.
+# Built once at import so SQLAlchemy's compiled cache always hits; datetimes are bound as
+# DateTime so they compare in the stored format
+_trust_inputs_stmt = text("""
+    WITH recent AS (
+        SELECT timestamp FROM behavioral_events
+        WHERE session_id = :session_id AND timestamp >= :temporal_since
+        ORDER BY timestamp DESC LIMIT :temporal_limit
+    ), history AS (
+        SELECT current_trust_score FROM user_sessions
+        WHERE user_id = :user_id AND login_time >= :history_since
+        ORDER BY login_time DESC LIMIT :history_limit
+    )
+    SELECT 'recent' AS kind, timestamp AS ts, NULL AS value,
+           NULL AS window_events, NULL AS anomalous FROM recent
+    UNION ALL
+    SELECT 'history', NULL, current_trust_score, NULL, NULL FROM history
+    UNION ALL
+    SELECT 'counts', NULL, count(*),
+           coalesce(sum(CASE WHEN timestamp >= :anomaly_since THEN 1 ELSE 0 END), 0),
+           coalesce(sum(CASE WHEN timestamp >= :anomaly_since THEN is_anomalous END), 0)
+    FROM behavioral_events
+    WHERE session_id = :session_id
+""").bindparams(
+    bindparam('session_id', type_=Integer),
+    bindparam('user_id', type_=Integer),
+    bindparam('temporal_since', type_=DateTime),
+    bindparam('temporal_limit', type_=Integer),
+    bindparam('history_since', type_=DateTime),
+    bindparam('history_limit', type_=Integer),
+    bindparam('anomaly_since', type_=DateTime)
+).columns(kind=String, ts=DateTime, value=Float, window_events=Integer, anomalous=Integer)
+
+def _welford_mean_var(values: Iterable[float]) -> Tuple[int, float, float]:
+    """Count, mean and population variance in one pass (Welford); plain floats, no NumPy dispatch"""
+    n = 0
+    mean = 0.0
+    m2 = 0.0
+    for x in values:
+        n += 1
+        delta = x - mean
+        mean += delta / n
+        m2 += delta * (x - mean)
+    return n, mean, (m2 / n if n else 0.0)
+
+# Temporal-consistency kernel over recent inter-event gaps: compiled with Numba when available
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _temporal_consistency_kernel(intervals):
+        """Score gap regularity from a one-pass mean/variance; fast, near-constant gaps look bot-like"""
+        mean = 0.0
+        m2 = 0.0
+        for i in range(intervals.size):
+            delta = intervals[i] - mean
+            mean += delta / (i + 1)
+            m2 += delta * (intervals[i] - mean)
+        variance = m2 / intervals.size
+        
+        # Consistent timing patterns indicate legitimate user
+        score = 1.0 / (1.0 + variance / max(mean, 1.0))
+        
+        # Check for suspicious patterns (too regular = bot-like)
+        if variance < 0.1 and mean < 1.0:
+            score *= 0.5
+        return min(1.0, max(0.0, score))
+else:
+    def _temporal_consistency_kernel(intervals):
+        """Score gap regularity from a one-pass mean/variance; fast, near-constant gaps look bot-like"""
+        _, mean, variance = _welford_mean_var(intervals.tolist())
+        score = 1.0 / (1.0 + variance / max(mean, 1.0))
+        if variance < 0.1 and mean < 1.0:
+            score *= 0.5
+        return min(1.0, max(0.0, score))
+
+def warm_trust_kernels():
+    """Compile (or load from cache) the JIT kernels before the first request"""
+    _temporal_consistency_kernel(np.ones(2))
+
 class TrustEngine:
     """
     Dynamic Trust Scoring Engine for SENTINELX
@@ -36,7 +140,10 @@ class TrustEngine:
     """
     
     def __init__(self):
-        self.predictor = RealTimePredictor()
+        # Share the process-wide predictor so its model cache is warmed once at startup
+        self.predictor = predictor
+        self._trust_cache = TTLCache(maxsize=TRUST_CACHE_SIZE, ttl=TRUST_CACHE_TTL_SECONDS)
+        self._trust_cache_lock = threading.Lock()
         
         # Trust calculation parameters
         self.trust_weights = {
@@ -47,6 +154,11 @@ class TrustEngine:
             'anomaly_frequency': 0.1      # Recent anomaly patterns
         }
         
+        # Fixed component order for the vectorized weighted sum
+        self._component_order = ('behavioral_score', 'temporal_consistency', 'session_context',
+                                 'historical_trust', 'anomaly_frequency')
+        self._weight_vec = np.array([self.trust_weights[c] for c in self._component_order])
+        
         # Trust decay parameters
         self.trust_decay = {
             'idle_decay_rate': 0.05,      # Trust decay per minute of inactivity
@@ -72,27 +184,49 @@ class TrustEngine:
             TrustLevel.HIGH: SecurityAction.INCREASE_MONITORING,
             TrustLevel.MAXIMUM: SecurityAction.NO_ACTION
         }
+        
+        # Levels from lowest to highest and the score each one above CRITICAL starts at,
+        # so a trust level is one binary search instead of an if/elif ladder
+        self._levels = (TrustLevel.CRITICAL, TrustLevel.LOW, TrustLevel.MODERATE,
+                        TrustLevel.HIGH, TrustLevel.MAXIMUM)
+        self._level_cutoffs = tuple(self.security_thresholds[level] for level in self._levels[:-1])
+        # Recommended action per level, indexed by the same search result
+        self._level_actions = tuple(self.trust_actions[level] for level in self._levels)
     
-    def calculate_trust_score(self, session_id: int, db: Session) -> Dict[str, Any]:
-        """Calculate comprehensive trust score for a session"""
+    def calculate_trust_score(self, session_id: int, db: Session,
+                              include_session_info: bool = False) -> Dict[str, Any]:
+        """Calculate comprehensive trust score for a session, optionally with its session context"""
+        
+        # One clock read per evaluation: every window, duration and timestamp below uses it
+        now = datetime.utcnow()
         
         try:
-            # Get session information
-            session = db.query(UserSession).filter(UserSession.id == session_id).first()
-            if not session:
+            # Get session information along with its newest event id for the result cache
+            row = db.query(UserSession, _latest_event_id).filter(UserSession.id == session_id).first()
+            if not row:
                 raise ValueError(f"Session {session_id} not found")
+            session, latest_event_id = row
+            
+            cache_key = (session_id, latest_event_id, include_session_info)
+            with self._trust_cache_lock:
+                cached_result = self._trust_cache.get(cache_key)
+            if cached_result is not None:
+                return cached_result
             
             # Get behavioral prediction
             behavioral_analysis = self.predictor.predict_anomaly(
                 session.user_id, session_id, db
             )
             
-            # Calculate component scores
+            # Calculate component scores (all event/history inputs come from one query)
+            trust_inputs = self._fetch_trust_inputs(session, now, db)
             behavioral_score = self._calculate_behavioral_score(behavioral_analysis)
-            temporal_score = self._calculate_temporal_consistency(session, db)
-            context_score = self._calculate_session_context_score(session, db)
-            historical_score = self._calculate_historical_trust(session.user_id, db)
-            anomaly_frequency_score = self._calculate_anomaly_frequency(session_id, db)
+            temporal_score = self._calculate_temporal_consistency(trust_inputs['recent_timestamps'])
+            context_score = self._calculate_session_context_score(session, trust_inputs['total_events'], now)
+            historical_score = self._calculate_historical_trust(trust_inputs['trust_history'])
+            anomaly_frequency_score = self._calculate_anomaly_frequency(
+                trust_inputs['window_events'], trust_inputs['anomalous_events']
+            )
             
             # Weighted trust calculation
             trust_components = {
@@ -103,20 +237,21 @@ class TrustEngine:
                 'anomaly_frequency': anomaly_frequency_score
             }
             
-            weighted_trust = sum(
-                score * self.trust_weights[component]
-                for component, score in trust_components.items()
-            )
+            weighted_trust = float(self._weight_vec @ np.array([
+                behavioral_score, temporal_score, context_score,
+                historical_score, anomaly_frequency_score
+            ]))
             
             # Apply trust bounds
-            final_trust_score = max(0.0, min(1.0, weighted_trust))
+            final_trust_score = self._clip01(weighted_trust)
             
             # Determine trust level and actions
-            trust_level = self._determine_trust_level(final_trust_score)
-            recommended_action = self.trust_actions[trust_level]
+            level_index = self._level_index(final_trust_score)
+            trust_level = self._levels[level_index]
+            recommended_action = self._level_actions[level_index]
             
             # Calculate trust trend
-            trust_trend = self._calculate_trust_trend(session_id, final_trust_score, db)
+            trust_trend = self._calculate_trust_trend(session, final_trust_score)
             
             result = {
                 'session_id': session_id,
@@ -127,16 +262,28 @@ class TrustEngine:
                 'trust_components': trust_components,
                 'behavioral_analysis': behavioral_analysis,
                 'trust_trend': trust_trend,
-                'calculated_at': datetime.utcnow().isoformat(),
+                'calculated_at': now.isoformat(timespec='milliseconds'),
                 'confidence': behavioral_analysis.get('confidence', 0.5)
             }
             
+            # Read from the loaded row before the trust update's commit expires it
+            if include_session_info:
+                result['session_info'] = {
+                    'duration_minutes': (now - session.login_time).total_seconds() / 60,
+                    'initial_trust': session.initial_trust_score,
+                    'trust_threshold': session.min_trust_threshold,
+                    'is_active': session.is_active
+                }
+            
             # Update session trust score
-            self._update_session_trust(session, final_trust_score, db)
+            self._update_session_trust(session, final_trust_score, now, db)
             
             # Log trust events
             self._log_trust_event(result, db)
             
+            with self._trust_cache_lock:
+                self._trust_cache[cache_key] = result
+            
             return result
             
         except Exception as e:
@@ -147,9 +294,39 @@ class TrustEngine:
                 'trust_level': TrustLevel.MODERATE.value,
                 'recommended_action': SecurityAction.INCREASE_MONITORING.value,
                 'error': str(e),
-                'calculated_at': datetime.utcnow().isoformat()
+                'calculated_at': now.isoformat(timespec='milliseconds')
             }
     
+    def _fetch_trust_inputs(self, session: UserSession, now: datetime, db: Session) -> Dict[str, Any]:
+        """Fetch every event/history input of the trust components in a single round trip"""
+        
+        rows = db.execute(_trust_inputs_stmt, {
+            'session_id': session.id,
+            'user_id': session.user_id,
+            'temporal_since': now - TEMPORAL_WINDOW,
+            'temporal_limit': TEMPORAL_EVENT_LIMIT,
+            'history_since': now - HISTORY_WINDOW,
+            'history_limit': HISTORY_SESSION_LIMIT,
+            'anomaly_since': now - ANOMALY_WINDOW
+        }).all()
+        
+        inputs = {'recent_timestamps': [], 'trust_history': [],
+                  'total_events': 0, 'window_events': 0, 'anomalous_events': 0}
+        for row in rows:
+            if row.kind == 'recent':
+                inputs['recent_timestamps'].append(row.ts)
+            elif row.kind == 'history':
+                inputs['trust_history'].append(row.value)
+            else:
+                # Session total and the anomaly window's counts come from one pass over its events
+                inputs['total_events'] = int(row.value)
+                inputs['window_events'] = int(row.window_events)
+                inputs['anomalous_events'] = int(row.anomalous)
+        
+        # UNION ALL does not keep the CTE's ordering; newest first as the helpers expect
+        inputs['recent_timestamps'].sort(reverse=True)
+        return inputs
+    
     def _calculate_behavioral_score(self, behavioral_analysis: Dict[str, Any]) -> float:
         """Convert behavioral anomaly analysis to trust score"""
         
@@ -162,50 +339,28 @@ class TrustEngine:
         # Adjust based on confidence
         confidence_adjusted = base_trust * confidence + (1.0 - confidence) * 0.5
         
-        return max(0.0, min(1.0, confidence_adjusted))
+        return self._clip01(confidence_adjusted)
     
-    def _calculate_temporal_consistency(self, session: UserSession, db: Session) -> float:
-        """Calculate trust based on temporal behavioral patterns"""
-        
-        # Get recent behavioral events
-        recent_events = db.query(BehavioralEvent).filter(
-            BehavioralEvent.session_id == session.id,
-            BehavioralEvent.timestamp >= datetime.utcnow() - timedelta(minutes=10)
-        ).order_by(BehavioralEvent.timestamp.desc()).limit(20).all()
+    def _calculate_temporal_consistency(self, timestamps: List[datetime]) -> float:
+        """Calculate trust based on temporal behavioral patterns (recent timestamps, newest first)"""
         
-        if len(recent_events) < 5:
+        if len(timestamps) < 5:
             return 0.7  # Neutral score for insufficient data
         
-        # Analyze event timing consistency
-        timestamps = [event.timestamp for event in recent_events]
-        time_intervals = [
-            (timestamps[i] - timestamps[i+1]).total_seconds()
-            for i in range(len(timestamps) - 1)
-        ]
-        
-        if not time_intervals:
-            return 0.7
-        
-        # Calculate consistency metrics
-        avg_interval = np.mean(time_intervals)
-        interval_variance = np.var(time_intervals)
-        
-        # Consistent timing patterns indicate legitimate user
-        consistency_score = 1.0 / (1.0 + interval_variance / max(avg_interval, 1.0))
+        # Analyze event timing consistency (gaps between consecutive events)
+        ts = np.array(timestamps, dtype='datetime64[us]')
+        time_intervals = (ts[:-1] - ts[1:]).astype(np.int64) / 1e6
         
-        # Check for suspicious patterns (too regular = bot-like)
-        if interval_variance < 0.1 and avg_interval < 1.0:
-            consistency_score *= 0.5  # Penalize bot-like behavior
-        
-        return max(0.0, min(1.0, consistency_score))
+        return float(_temporal_consistency_kernel(time_intervals))
     
-    def _calculate_session_context_score(self, session: UserSession, db: Session) -> float:
+    def _calculate_session_context_score(self, session: UserSession, total_events: int,
+                                         now: datetime) -> float:
         """Calculate trust based on session context and metadata"""
         
         context_score = 1.0
         
         # Session duration analysis
-        session_duration = (datetime.utcnow() - session.login_time).total_seconds()
+        session_duration = (now - session.login_time).total_seconds()
         
         # Very short sessions are suspicious
         if session_duration < 60:  # Less than 1 minute
@@ -214,10 +369,6 @@ class TrustEngine:
             context_score *= 0.8  # Long sessions slightly suspicious
         
         # Activity level analysis
-        total_events = db.query(BehavioralEvent).filter(
-            BehavioralEvent.session_id == session.id
-        ).count()
-        
         if session_duration > 0:
             events_per_minute = (total_events * 60) / session_duration
             
@@ -234,82 +385,57 @@ class TrustEngine:
         if session.ip_address:
             context_score *= 1.0  # Placeholder for IP analysis
         
-        return max(0.0, min(1.0, context_score))
+        return self._clip01(context_score)
     
-    def _calculate_historical_trust(self, user_id: int, db: Session) -> float:
-        """Calculate trust based on user's historical behavior"""
+    def _calculate_historical_trust(self, trust_history: List[Optional[float]]) -> float:
+        """Calculate trust based on user's historical behavior (their recent sessions' trust scores)"""
         
-        # Get user's recent sessions
-        recent_sessions = db.query(UserSession).filter(
-            UserSession.user_id == user_id,
-            UserSession.login_time >= datetime.utcnow() - timedelta(days=7)
-        ).order_by(UserSession.login_time.desc()).limit(10).all()
-        
-        if not recent_sessions:
+        if not trust_history:
             return 0.5  # Neutral for new users
         
-        # Calculate average historical trust
-        trust_scores = [s.current_trust_score for s in recent_sessions if s.current_trust_score]
+        # Calculate average historical trust and its stability (variance) in one pass
+        scored, avg_historical_trust, trust_variance = _welford_mean_var(
+            score for score in trust_history if score
+        )
         
-        if not trust_scores:
+        if not scored:
             return 0.5
         
-        avg_historical_trust = np.mean(trust_scores)
-        
         # Consider trust stability
-        trust_variance = np.var(trust_scores)
         stability_factor = 1.0 / (1.0 + trust_variance)
         
         # Combine average trust with stability
         historical_score = avg_historical_trust * stability_factor
         
-        return max(0.0, min(1.0, historical_score))
+        return self._clip01(historical_score)
     
-    def _calculate_anomaly_frequency(self, session_id: int, db: Session) -> float:
-        """Calculate trust based on recent anomaly frequency"""
+    def _calculate_anomaly_frequency(self, window_events: int, anomalous_events: int) -> float:
+        """Calculate trust based on recent anomaly frequency (event and anomaly counts in the window)"""
         
-        # Get recent behavioral events with anomaly scores
-        recent_events = db.query(BehavioralEvent).filter(
-            BehavioralEvent.session_id == session_id,
-            BehavioralEvent.timestamp >= datetime.utcnow() - timedelta(minutes=15)
-        ).all()
-        
-        if not recent_events:
+        if not window_events:
             return 1.0  # No recent data = neutral
         
-        # Count anomalous events
-        anomalous_events = sum(1 for event in recent_events if event.is_anomalous)
-        anomaly_rate = anomalous_events / len(recent_events)
+        anomaly_rate = anomalous_events / window_events
         
         # Convert anomaly rate to trust score
         frequency_score = 1.0 - anomaly_rate
         
-        return max(0.0, min(1.0, frequency_score))
+        return self._clip01(frequency_score)
     
-    def _determine_trust_level(self, trust_score: float) -> TrustLevel:
-        """Determine trust level from numerical score"""
-        
-        if trust_score >= 0.8:
-            return TrustLevel.MAXIMUM
-        elif trust_score >= 0.6:
-            return TrustLevel.HIGH
-        elif trust_score >= 0.4:
-            return TrustLevel.MODERATE
-        elif trust_score >= 0.2:
-            return TrustLevel.LOW
-        else:
-            return TrustLevel.CRITICAL
+    @staticmethod
+    def _clip01(x: float) -> float:
+        """Clamp a score to [0, 1] without builtin calls; NaN maps to 1.0 like max(0, min(1, x))"""
+        return 0.0 if x < 0.0 else (x if x <= 1.0 else 1.0)
     
-    def _calculate_trust_trend(self, session_id: int, current_trust: float, 
-                             db: Session) -> Dict[str, Any]:
-        """Calculate trust trend over time"""
-        
-        # Get recent trust history (simplified - would use dedicated trust log table)
-        session = db.query(UserSession).filter(UserSession.id == session_id).first()
-        
-        if not session:
-            return {"trend": "stable", "change": 0.0}
+    def _level_index(self, trust_score: float) -> int:
+        """Position of a score's trust level in `_levels` / `_level_actions`"""
+        # bisect_right: a score equal to a cutoff belongs to the level starting there
+        return bisect_right(self._level_cutoffs, trust_score)
+    
+    def _calculate_trust_trend(self, session: UserSession, current_trust: float) -> Dict[str, Any]:
+        """Calculate trust trend over time from the already loaded session row"""
         
+        # Recent trust history (simplified - would use dedicated trust log table)
         previous_trust = session.current_trust_score or session.initial_trust_score
         trust_change = current_trust - previous_trust
         
@@ -328,27 +454,49 @@ class TrustEngine:
             "change_magnitude": abs(trust_change)
         }
     
-    def _update_session_trust(self, session: UserSession, trust_score: float, db: Session):
+    def _update_session_trust(self, session: UserSession, trust_score: float,
+                              now: datetime, db: Session):
         """Update session trust score in database"""
         
-        session.current_trust_score = trust_score
-        session.last_activity = datetime.utcnow()
+        self.flush_trust_updates([(session, trust_score)], now, db)
+    
+    def flush_trust_updates(self, updates: Iterable[Tuple[UserSession, float]],
+                            now: datetime, db: Session):
+        """Write (session, trust score) pairs in one executemany UPDATE, bypassing the unit of work"""
+        
+        updates = list(updates)
+        if not updates:
+            return
+        
+        # Read tokens before commit expires the rows, so invalidation doesn't reload them
+        session_tokens = [session.session_token for session, _ in updates]
+        db.execute(update(UserSession), [
+            {'id': session.id, 'current_trust_score': trust_score, 'last_activity': now}
+            for session, trust_score in updates
+        ])
         db.commit()
+        for session_token in session_tokens:
+            invalidate_active_session(session_token)
     
     def _log_trust_event(self, trust_result: Dict[str, Any], db: Session):
         """Log trust calculation event for audit trail"""
         
         # In production, this would write to a dedicated trust_events table
-        if trust_result['trust_level'] in ['critical', 'low']:
-            logger.warning(f"Low trust detected: {trust_result}")
-        elif trust_result['trust_level'] == 'moderate':
-            logger.info(f"Moderate trust: Session {trust_result['session_id']}")
+        trust_level = trust_result['trust_level']
+        if trust_level in _LOW_TRUST_LEVELS:
+            # Lazy %-formatting: the result dict is only rendered if the record is emitted
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning("Low trust detected: %s", trust_result)
+        elif trust_level == TrustLevel.MODERATE.value:
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("Moderate trust: Session %s", trust_result['session_id'])
     
     def execute_security_action(self, session_id: int, action: SecurityAction, 
-                              db: Session) -> Dict[str, Any]:
-        """Execute recommended security action"""
+                              db: Session, session: Optional[UserSession] = None) -> Dict[str, Any]:
+        """Execute recommended security action, reusing `session` when the caller already loaded it"""
         
-        session = db.query(UserSession).filter(UserSession.id == session_id).first()
+        if session is None:
+            session = db.query(UserSession).filter(UserSession.id == session_id).first()
         if not session:
             return {"success": False, "message": "Session not found"}
         
@@ -356,6 +504,7 @@ class TrustEngine:
             if action == SecurityAction.TERMINATE_SESSION:
                 session.is_active = False
                 db.commit()
+                invalidate_active_session(session.session_token)
                 logger.warning(f"Session {session_id} terminated due to low trust")
                 return {
                     "success": True,
@@ -367,6 +516,7 @@ class TrustEngine:
                 # Set flag for re-authentication requirement
                 session.current_trust_score = min(session.current_trust_score, 0.3)
                 db.commit()
+                invalidate_active_session(session.session_token)
                 logger.info(f"Re-authentication required for session {session_id}")
                 return {
                     "success": True,
@@ -409,19 +559,7 @@ class TrustEngine:
     def get_session_trust_summary(self, session_id: int, db: Session) -> Dict[str, Any]:
         """Get comprehensive trust summary for a session"""
         
-        trust_result = self.calculate_trust_score(session_id, db)
-        
-        # Add additional context
-        session = db.query(UserSession).filter(UserSession.id == session_id).first()
-        if session:
-            trust_result['session_info'] = {
-                'duration_minutes': (datetime.utcnow() - session.login_time).total_seconds() / 60,
-                'initial_trust': session.initial_trust_score,
-                'trust_threshold': session.min_trust_threshold,
-                'is_active': session.is_active
-            }
-        
-        return trust_result
+        return self.calculate_trust_score(session_id, db, include_session_info=True)
 
 # Global trust engine instance
 trust_engine = TrustEngine()
\ No newline at end of file
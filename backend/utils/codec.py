@@ -0,0 +1,41 @@
+# Compact storage encoding for raw behavioral event payloads
+# Raw event streams are stored as zstd-compressed MessagePack. Rows written before
+# the switch hold JSON text; they are detected by the missing zstd frame header and
+# decoded as JSON, so old data migrates lazily as it is rewritten.
+
+import threading
+from typing import Any, Union
+
+import msgpack
+import orjson
+import zstandard
+
+ZSTD_LEVEL = 3
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# zstd (de)compressor contexts are reusable but not thread-safe: keep one per thread
+_zstd_local = threading.local()
+
+def _compressor() -> zstandard.ZstdCompressor:
+    """Per-thread reusable zstd compressor"""
+    if not hasattr(_zstd_local, "compressor"):
+        _zstd_local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return _zstd_local.compressor
+
+def _decompressor() -> zstandard.ZstdDecompressor:
+    """Per-thread reusable zstd decompressor"""
+    if not hasattr(_zstd_local, "decompressor"):
+        _zstd_local.decompressor = zstandard.ZstdDecompressor()
+    return _zstd_local.decompressor
+
+def encode_event_data(data: Any) -> bytes:
+    """Pack a raw event payload as zstd-compressed MessagePack"""
+    return _compressor().compress(msgpack.packb(data, use_bin_type=True))
+
+def decode_event_data(payload: Union[bytes, str, None]) -> Any:
+    """Unpack a stored raw event payload, accepting legacy JSON text rows"""
+    if payload is None:
+        return None
+    if isinstance(payload, (bytes, bytearray, memoryview)) and bytes(payload[:4]) == ZSTD_MAGIC:
+        return msgpack.unpackb(_decompressor().decompress(payload), raw=False)
+    return orjson.loads(payload)
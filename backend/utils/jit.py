@@ -0,0 +1,15 @@
+# Optional Numba JIT support
+# Numba is not a hard dependency; callers check NUMBA_AVAILABLE and keep a
+# pure NumPy fallback for environments without it.
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit when Numba is not installed"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
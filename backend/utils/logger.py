@@ -1,15 +1,46 @@
+import atexit
 import logging
+import queue
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
 # Create logs directory if it doesn't exist
 log_dir = Path("logs")
 log_dir.mkdir(exist_ok=True)
 
+# One file and one console handler shared by every SENTINELX logger: a single fd and
+# buffer for the day's log file. The file is only opened on the first record.
+log_file = log_dir / f"sentinelx_{datetime.now().strftime('%Y%m%d')}.log"
+_file_handler = logging.FileHandler(log_file, delay=True)
+_file_handler.setLevel(logging.DEBUG)
+_file_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+))
+
+# Level filtering happens on each logger, so the shared console handler passes everything
+_console_handler = logging.StreamHandler(sys.stdout)
+_console_handler.setLevel(logging.DEBUG)
+_console_handler.setFormatter(logging.Formatter(
+    '%(asctime)s - %(levelname)s - %(message)s'
+))
+
+# Handler I/O runs on one listener thread; callers only enqueue the record
+_log_queue = queue.Queue(-1)
+_queue_handler = QueueHandler(_log_queue)
+_log_listener = QueueListener(_log_queue, _file_handler, _console_handler, respect_handler_level=True)
+_log_listener.start()
+
+def stop_log_listener():
+    """Flush queued records and stop the logging listener thread"""
+    _log_listener.stop()
+
+atexit.register(stop_log_listener)
+
 # Configure logging
 def setup_logger(name: str = "SENTINELX", level: int = logging.INFO):
-    """Setup logger with file and console handlers"""
+    """Setup logger with the shared file and console handlers"""
     
     logger = logging.getLogger(name)
     logger.setLevel(level)
@@ -18,28 +49,7 @@ def setup_logger(name: str = "SENTINELX", level: int = logging.INFO):
     if logger.handlers:
         return logger
     
-    # Create formatters
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-    )
-    console_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s'
-    )
-    
-    # File handler
-    log_file = log_dir / f"sentinelx_{datetime.now().strftime('%Y%m%d')}.log"
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(file_formatter)
-    
-    # Console handler
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(level)
-    console_handler.setFormatter(console_formatter)
-    
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    logger.addHandler(_queue_handler)
     
     return logger
 
@@ -51,16 +61,23 @@ security_logger = setup_logger("SENTINELX_SECURITY", logging.WARNING)
 
 def log_security_event(event_type: str, user_id: int, details: dict):
     """Log security-related events"""
-    security_logger.warning(f"SECURITY_EVENT: {event_type} - User: {user_id} - Details: {details}")
+    security_logger.warning("SECURITY_EVENT: %s - User: %s - Details: %s", event_type, user_id, details)
 
 def log_trust_event(user_id: int, session_id: int, trust_score: float, action: str):
     """Log trust score events"""
-    logger.info(f"TRUST_EVENT: User {user_id}, Session {session_id}, Score: {trust_score:.3f}, Action: {action}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("TRUST_EVENT: User %s, Session %s, Score: %.3f, Action: %s",
+                    user_id, session_id, trust_score, action)
 
 def log_behavioral_event(user_id: int, event_type: str, anomaly_score: float):
     """Log behavioral analysis events"""
-    logger.info(f"BEHAVIORAL_EVENT: User {user_id}, Type: {event_type}, Anomaly Score: {anomaly_score:.3f}")
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("BEHAVIORAL_EVENT: User %s, Type: %s, Anomaly Score: %.3f",
+                    user_id, event_type, anomaly_score)
 
 def log_ml_event(user_id: int, model_type: str, action: str, result: dict):
     """Log machine learning events"""
-    logger.info(f"ML_EVENT: User {user_id}, Model: {model_type}, Action: {action}, Result: {result}")
\ No newline at end of file
+    # The result dict is only rendered when INFO is actually emitted
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("ML_EVENT: User %s, Model: %s, Action: %s, Result: %s",
+                    user_id, model_type, action, result)
@@ -0,0 +1,30 @@
+# orjson-backed request parsing for FastAPI routes
+# FastAPI decodes JSON bodies through Request.json() (stdlib json); routes built
+# with ORJSONRoute hand it an orjson-decoding Request instead. Pydantic v2 then
+# validates the already-decoded payload in pydantic-core.
+
+from typing import Any, Callable
+
+import orjson
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+class _ORJSONRequest(Request):
+    """Request whose JSON body is decoded with orjson"""
+    
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            # orjson.JSONDecodeError subclasses json.JSONDecodeError, so FastAPI still reports a 422
+            self._json = orjson.loads(await self.body())
+        return self._json
+
+class ORJSONRoute(APIRoute):
+    """APIRoute that parses request bodies with orjson"""
+    
+    def get_route_handler(self) -> Callable:
+        original_route_handler = super().get_route_handler()
+        
+        async def orjson_route_handler(request: Request) -> Response:
+            return await original_route_handler(_ORJSONRequest(request.scope, request.receive))
+        
+        return orjson_route_handler
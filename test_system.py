@@ -33,6 +33,76 @@ def test_database():
         print(f"❌ Database test failed: {e}")
         return False
 
+def test_event_write_retention():
+    """Test that failed behavioral event writes are kept for retry, not dropped"""
+    try:
+        from backend.database.db import (
+            drain_dead_letter_events, get_event_write_stats, has_pending_event_retries, write_behavioral_events
+        )
+        
+        print("📥 Testing behavioral event write retention...")
+        
+        # session_id is NOT NULL, so this insert fails on every attempt
+        failing_event = {"session_id": None, "event_type": "keystroke", "processed_features": "{}"}
+        written = write_behavioral_events([failing_event])
+        pending = get_event_write_stats()["events_pending_retry"]
+        
+        while has_pending_event_retries():
+            write_behavioral_events([])
+        dead_lettered = drain_dead_letter_events()
+        
+        if written != 0 or pending != 1:
+            raise Exception(f"Failed write was not queued for retry (written={written}, pending={pending})")
+        if dead_lettered != [failing_event]:
+            raise Exception("Failed event was lost instead of dead-lettered")
+        
+        print("✅ Failed event writes are retried and then dead-lettered")
+        return True
+    except Exception as e:
+        print(f"❌ Event write retention test failed: {e}")
+        return False
+
+def test_event_write_poison_row():
+    """Test that one bad row in a failing batch doesn't dead-letter the valid events with it"""
+    try:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        import backend.database.db as db_module
+        from backend.database.models import Base, BehavioralEvent
+        
+        print("🧪 Testing behavioral event poison-row fallback...")
+        
+        # Scratch in-memory database so the valid rows don't land in sentinelx.db
+        memory_engine = create_engine("sqlite://", poolclass=StaticPool)
+        Base.metadata.create_all(memory_engine)
+        original_session_local = db_module.SessionLocal
+        db_module.SessionLocal = sessionmaker(bind=memory_engine)
+        try:
+            valid_events = [{"session_id": 1, "event_type": "keystroke", "processed_features": "{}"} for _ in range(3)]
+            poison_event = {"session_id": None, "event_type": "keystroke", "processed_features": "{}"}
+            written = db_module.write_behavioral_events(valid_events + [poison_event])
+            while db_module.has_pending_event_retries():
+                written += db_module.write_behavioral_events([])
+            dead_lettered = db_module.drain_dead_letter_events()
+            
+            db = db_module.SessionLocal()
+            stored = db.query(BehavioralEvent).count()
+            db.close()
+        finally:
+            db_module.SessionLocal = original_session_local
+        
+        if written != 3 or stored != 3:
+            raise Exception(f"Valid events were not salvaged (written={written}, stored={stored})")
+        if dead_lettered != [poison_event]:
+            raise Exception(f"Expected only the poison row dead-lettered, got {len(dead_lettered)} rows")
+        
+        print("✅ Only the failing row was dead-lettered")
+        return True
+    except Exception as e:
+        print(f"❌ Event poison-row test failed: {e}")
+        return False
+
 def test_auth_service():
     """Test authentication service"""
     try:
@@ -156,6 +226,8 @@ def run_all_tests():
     
     tests = [
         ("Database", test_database),
+        ("Event Writes", test_event_write_retention),
+        ("Poison Events", test_event_write_poison_row),
         ("Authentication", test_auth_service),
         ("ML Components", test_ml_components),
         ("Trust Engine", test_trust_engine),